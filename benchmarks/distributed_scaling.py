@@ -0,0 +1,55 @@
+"""
+Scaling of distributed_render.py with the number of worker processes.
+
+    python benchmarks/distributed_scaling.py scenes.la_valse_cornellbox --workers 1 2 4 8 --spp 256 --json scaling.json
+
+Every run renders the same samples, the speedup is measured on the slowest
+shard without its compilation, and on the wall time of the whole run.
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import distributed_render
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the scaling of distributed_render.py.")
+    parser.add_argument('scene', help="scene module, e.g. scenes.la_valse_cornellbox")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help="worker counts to measure (default: 1 2 4)")
+    parser.add_argument('--spp', type=int, default=64, help="samples per pixel of every run (default: 64)")
+    parser.add_argument('--threads-per-worker', type=int, default=None, help="cpu threads of every worker (default: cores / workers)")
+    parser.add_argument('--output-dir', default='scaling', help="directory of the renders and shards (default: scaling)")
+    parser.add_argument('--json', default=None, help="write the results to this file")
+    return parser.parse_args(argv)
+
+
+def main(args):
+    results = []
+    for workers in args.workers:
+        argv = [args.scene, '--workers', str(workers), '--spp', str(args.spp),
+                '-o', os.path.join(args.output_dir, f"workers_{workers}.npy")]
+        if args.threads_per_worker is not None:
+            argv += ['--threads-per-worker', str(args.threads_per_worker)]
+        run = distributed_render.render(distributed_render.parse_args(argv))
+        run['workers'] = workers
+        results.append(run)
+
+    base = results[0]
+    print(f"{'workers':>8} {'render s':>9} {'speedup':>8} {'efficiency':>10} {'wall s':>8} {'wall speedup':>12}")
+    for run in results:
+        # Throughput relative to the first run, whatever its worker count
+        run['speedup'] = (run['timed_samples'] / run['render_time']) / (base['timed_samples'] / base['render_time'])
+        run['efficiency'] = run['speedup'] * base['workers'] / run['workers']
+        run['wall_speedup'] = base['wall_time'] / run['wall_time']
+        print(f"{run['workers']:>8} {run['render_time']:>9.2f} {run['speedup']:>8.2f} {run['efficiency']:>10.0%} {run['wall_time']:>8.2f} {run['wall_speedup']:>12.2f}")
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump({'scene': args.scene, 'spp': args.spp, 'cpu_count': os.cpu_count(), 'runs': results}, f, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    main(parse_args())
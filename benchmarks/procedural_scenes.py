@@ -0,0 +1,160 @@
+"""
+Benchmark scenes built in code, without any mesh file. Import after ti.init,
+like the scene modules.
+
+Every builder returns a dict with the scene, its camera and the time spent
+building the BVHs : 'blas_build_time' for the mesh asset, if any (SAH
+build, threading, wide BVH and triangle records), and 'tlas_build_time' for
+the SAH build of the top-level BVH done by Scene.buildTLAS. Mesh scenes
+also give the bytes of their indexed triangle buffer, 'triangle_buffer_bytes',
+and of the same triangles as Triangle records, 'triangle_record_bytes'.
+"""
+import time
+import numpy as np
+import taichi as ti
+from models.vector import Vec3, Color, Point, MaterialCoord
+from material import Lambertian, Metal, DiffuseLight, Dielectric
+from models.camera import Camera
+from models.sphere import Sphere
+from models.quad import create_quad
+from models.scene import Scene
+from models.mesh import create_mesh
+from models.triangle import Triangle
+from utils.create_buffers import quadListToBuffer, sphereListToBuffer, meshListToBuffer, meshAssetToBuffers, fieldBytes, triangleBufferBytes
+from bvh.asset_cache import mesh_asset_from_arrays
+
+BOX_SIZE = 555.
+
+
+def cornell_camera(width):
+    return Camera(lookfrom=Point(278., 278., -800.), lookat=Vec3(278., 278., 0.), vup=Vec3(0., 1., 0.), aspect_ratio=1., image_width=width, vfov=38.)
+
+
+def cornell_quads():
+    # The front wall is last : primary rays skip the last quad, the camera is outside the box
+    return [
+        create_quad(q=Point(555., 0., 0.), u=Vec3(0., 555., 0.), v=Vec3(0., 0., 555.), material_coord=(0, 2)),
+        create_quad(q=Point(0., 0., 0.), u=Vec3(0., 555., 0.), v=Vec3(0., 0., 555.), material_coord=(0, 0)),
+        create_quad(q=Point(343., 554., 332.), u=Vec3(-130., 0., 0.), v=Vec3(0., 0., -105.), material_coord=(2, 0)),
+        create_quad(q=Point(0., 0., 0.), u=Vec3(555., 0., 0.), v=Vec3(0., 0., 555.), material_coord=(0, 1)),
+        create_quad(q=Point(555., 555., 555.), u=Vec3(-555., 0., 0.), v=Vec3(0., 0., -555.), material_coord=(0, 1)),
+        create_quad(q=Point(0., 0., 555.), u=Vec3(555., 0., 0.), v=Vec3(0., 555., 0.), material_coord=(0, 1)),
+        create_quad(q=Point(0., 0., 0.), u=Vec3(555., 0., 0.), v=Vec3(0., 555., 0.), material_coord=(0, 1)),
+    ]
+
+
+def cornell_materials():
+    return {
+        'lamb_materials': [Lambertian(albedo=Color(.65, .05, .05)), Lambertian(albedo=Color(.73, .73, .73)), Lambertian(albedo=Color(.12, .45, .15))],
+        'metal_materials': [Metal(albedo=Color(.8, .8, .8), fuzz=0.)],
+        'diffuseLight_materials': [DiffuseLight(emmissionColor=Color(40., 27., 20.))],
+        'dielectric_materials': [Dielectric(ir=1.5)],
+    }
+
+
+def build_scene(cam, **buffers):
+    scene = Scene(**buffers, **cornell_materials())
+    return {'scene': scene, 'cam': cam, 'blas_build_time': 0., 'tlas_build_time': scene.tlas_build_time,
+            'triangle_buffer_bytes': 0, 'triangle_record_bytes': 0}
+
+
+def cornell_box(width):
+    """The Cornell box of la_valse_cornellbox, with a metal and a glass sphere instead of the mesh."""
+    spheres = [
+        Sphere(center=Point(185., 90., 170.), radius=90., material_coord=MaterialCoord(1, 0)),
+        Sphere(center=Point(380., 90., 350.), radius=90., material_coord=MaterialCoord(3, 0)),
+    ]
+    return build_scene(cornell_camera(width), sphere_buffer=sphereListToBuffer(spheres), quad_buffer=quadListToBuffer(cornell_quads()))
+
+
+def sphere_field(width, count=16, seed=0):
+    """A count x count grid of small spheres of every material on a floor, lit by a quad."""
+    rng = np.random.default_rng(seed)
+    spacing = BOX_SIZE / count
+    spheres = []
+    for i in range(count):
+        for j in range(count):
+            radius = spacing * rng.uniform(0.2, 0.4)
+            center = Point(spacing * (i + 0.5), radius, spacing * (j + 0.5))
+            # Lambertian, metal and glass, in the material buffers of cornell_materials
+            material = [MaterialCoord(0, int(rng.integers(3))), MaterialCoord(1, 0), MaterialCoord(3, 0)][int(rng.integers(3))]
+            spheres.append(Sphere(center=center, radius=radius, material_coord=material))
+    quads = [
+        create_quad(q=Point(-BOX_SIZE, 0., -BOX_SIZE), u=Vec3(3 * BOX_SIZE, 0., 0.), v=Vec3(0., 0., 3 * BOX_SIZE), material_coord=(0, 1)),
+        create_quad(q=Point(BOX_SIZE / 4, BOX_SIZE, BOX_SIZE / 4), u=Vec3(BOX_SIZE / 2, 0., 0.), v=Vec3(0., 0., BOX_SIZE / 2), material_coord=(2, 0)),
+        # Behind the camera, the last quad is skipped by primary rays
+        create_quad(q=Point(-BOX_SIZE, 0., -2 * BOX_SIZE), u=Vec3(3 * BOX_SIZE, 0., 0.), v=Vec3(0., 2 * BOX_SIZE, 0.), material_coord=(0, 1)),
+    ]
+    cam = Camera(lookfrom=Point(278., 400., -500.), lookat=Vec3(278., 0., 278.), vup=Vec3(0., 1., 0.), aspect_ratio=1., image_width=width, vfov=50.)
+    return build_scene(cam, sphere_buffer=sphereListToBuffer(spheres), quad_buffer=quadListToBuffer(quads))
+
+
+def icosphere_arrays(subdivisions):
+    """
+    Vertices and faces of an icosahedron subdivided subdivisions times, on the unit sphere.
+
+    Returns:
+        tuple: (vertices (V, 3) float32, faces (20 * 4**subdivisions, 3) int32)
+    """
+    t = (1. + np.sqrt(5.)) / 2.
+    vertices = np.array([
+        [-1, t, 0], [1, t, 0], [-1, -t, 0], [1, -t, 0],
+        [0, -1, t], [0, 1, t], [0, -1, -t], [0, 1, -t],
+        [t, 0, -1], [t, 0, 1], [-t, 0, -1], [-t, 0, 1],
+    ], dtype=np.float64)
+    faces = np.array([
+        [0, 11, 5], [0, 5, 1], [0, 1, 7], [0, 7, 10], [0, 10, 11],
+        [1, 5, 9], [5, 11, 4], [11, 10, 2], [10, 7, 6], [7, 1, 8],
+        [3, 9, 4], [3, 4, 2], [3, 2, 6], [3, 6, 8], [3, 8, 9],
+        [4, 9, 5], [2, 4, 11], [6, 2, 10], [8, 6, 7], [9, 8, 1],
+    ], dtype=np.int64)
+    vertices /= np.linalg.norm(vertices, axis=1, keepdims=True)
+    for _ in range(subdivisions):
+        # One new vertex per edge, shared by the two faces of the edge
+        edges = np.sort(np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]]), axis=1)
+        unique_edges, edge_index = np.unique(edges, axis=0, return_inverse=True)
+        midpoints = vertices[unique_edges[:, 0]] + vertices[unique_edges[:, 1]]
+        midpoints /= np.linalg.norm(midpoints, axis=1, keepdims=True)
+        ab, bc, ca = (len(vertices) + edge_index.reshape(3, -1))
+        a, b, c = faces.T
+        faces = np.concatenate([np.stack(face, axis=1) for face in ((a, ab, ca), (b, bc, ab), (c, ca, bc), (ab, bc, ca))])
+        vertices = np.concatenate([vertices, midpoints])
+    return vertices.astype(np.float32), faces.astype(np.int32)
+
+
+def icosphere(width, subdivisions=4):
+    """An icosphere of 20 * 4**subdivisions triangles in the Cornell box."""
+    vertices, faces = icosphere_arrays(subdivisions)
+    start = time.perf_counter()
+    mesh_asset = mesh_asset_from_arrays(vertices, faces, box_size=300)
+    blas_build_time = time.perf_counter() - start
+    triangle_buffer, bvhNode_buffer = meshAssetToBuffers(mesh_asset, indexed=True)
+    mesh = create_mesh(beginIndex=0, meshLen=mesh_asset[0]['triangle_number'], material_coord=(0, 1),
+        translation=ti.Vector([278., 160., 278.]), rotation=ti.Vector([0., 0., 0.]), scale=ti.Vector([1., 1., 1.]))
+    built = build_scene(cornell_camera(width), quad_buffer=quadListToBuffer(cornell_quads()), triangle_buffer=triangle_buffer,
+                        bvhNode_buffer=bvhNode_buffer, mesh_buffer=meshListToBuffer([mesh]))
+    built['blas_build_time'] = blas_build_time
+    built['triangle_buffer_bytes'] = triangleBufferBytes(triangle_buffer)
+    # Size of one record of a real Triangle field, without allocating them all
+    built['triangle_record_bytes'] = fieldBytes(Triangle.field(shape=1)) * mesh_asset[0]['triangle_number']
+    return built
+
+
+SCENES = {
+    'cornell_box': cornell_box,
+    'sphere_field': sphere_field,
+    'icosphere': icosphere,
+}
+
+
+def build(case, width):
+    """
+    Scene of a benchmark case, a SCENES name with an optional integer
+    argument, e.g. 'icosphere:6' or 'sphere_field:32'.
+    """
+    name, _, argument = case.partition(':')
+    if name not in SCENES:
+        raise ValueError(f"unknown scene {name}, expected one of {list(SCENES)}")
+    if argument:
+        return SCENES[name](width, int(argument))
+    return SCENES[name](width)
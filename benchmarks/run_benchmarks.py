@@ -0,0 +1,176 @@
+"""
+Rendering benchmarks on the procedural scenes of benchmarks/procedural_scenes.py.
+
+    python benchmarks/run_benchmarks.py --json results.json
+    python benchmarks/run_benchmarks.py --cases cornell_box icosphere:6 --width 256 --spp 32 --arch cuda
+
+Every case runs in its own process, so its peak memory and compilation do
+not leak into the next one. Per case it reports:
+    primary rays/s          camera rays intersected with the scene, no shading
+    path samples/s, rays/s  full paths traced by models.integrator.trace
+    box/triangle tests      per primary ray, and per ray of the paths (shadow rays included)
+    BVH build times         mesh asset (SAH build, threading, wide BVH) and top-level SAH build
+    triangle memory         indexed triangle buffer, and the same triangles as Triangle records
+    peak memory             maximum resident size of the process
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DEFAULT_CASES = ['cornell_box', 'sphere_field', 'icosphere:2', 'icosphere:4', 'icosphere:6']
+ARCHS = ('cpu', 'gpu', 'cuda', 'vulkan', 'metal')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the renderer on procedural scenes.")
+    parser.add_argument('--cases', nargs='+', default=DEFAULT_CASES, help=f"scenes to run, NAME or NAME:ARGUMENT (default: {' '.join(DEFAULT_CASES)})")
+    parser.add_argument('--arch', choices=ARCHS, default='cpu', help="taichi backend (default: cpu)")
+    parser.add_argument('--width', type=int, default=128, help="image width and height (default: 128)")
+    parser.add_argument('--spp', type=int, default=16, help="path samples per pixel, after the compilation launch (default: 16)")
+    parser.add_argument('--primary-launches', type=int, default=16, help="primary ray launches of one ray per pixel (default: 16)")
+    parser.add_argument('--json', default=None, help="write the results to this file")
+    parser.add_argument('--run-case', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--case-output', default=None, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def run_case(args):
+    """Benchmark args.run_case in this process and write its results to args.case_output."""
+    import numpy as np
+    import taichi as ti
+    ti.init(arch=getattr(ti, args.arch))
+    import procedural_scenes
+    from models.integrator import trace
+    from utils.sampler import startSampler
+    from utils import stats
+
+    built = procedural_scenes.build(args.run_case, args.width)
+    scene, cam = built['scene'], built['cam']
+    res = cam.resolution
+    pixels = res[0] * res[1]
+    color_buffer = ti.Vector.field(3, dtype=ti.f32, shape=res)
+    # Triangle tests, box tests (and rays for the paths) of every pixel
+    primary_stats = ti.Vector.field(2, dtype=ti.i32, shape=res)
+    path_stats = ti.Vector.field(3, dtype=ti.i32, shape=res)
+    stats.allocate(res)
+
+    @ti.kernel
+    def castPrimary(sample: ti.i32):
+        for u, v in primary_stats:
+            sampler = startSampler(u, v, sample)
+            ray = cam.get_ray(u, v, sampler)
+            _, triangle_count, box_count = scene.hit(ray, 0)
+            primary_stats[u, v] += ti.Vector([triangle_count, box_count])
+
+    @ti.kernel
+    def tracePaths(spp: ti.i32, first_sample: ti.i32):
+        for u, v in color_buffer:
+            for s in range(spp):
+                sampler = startSampler(u, v, first_sample + s)
+                ray = cam.get_ray(u, v, sampler)
+                color, triangle_count, box_count, nb_rays, _ = trace(ray, scene, sampler)
+                color_buffer[u, v] += color
+                path_stats[u, v] += ti.Vector([triangle_count, box_count, nb_rays])
+
+    def timed(launch, count):
+        # The first launch compiles the kernel, then the stats only count the timed launches
+        launch(0)
+        ti.sync()
+        primary_stats.fill(0)
+        path_stats.fill(0)
+        start = time.perf_counter()
+        for i in range(count):
+            launch(i + 1)
+        ti.sync()
+        return time.perf_counter() - start
+
+    primary_time = timed(castPrimary, args.primary_launches)
+    primary = primary_stats.to_numpy().astype(np.int64).sum(axis=(0, 1))
+    primary_rays = pixels * args.primary_launches
+
+    path_time = timed(lambda sample: tracePaths(1 if sample == 0 else args.spp, sample), 1)
+    paths = path_stats.to_numpy().astype(np.int64).sum(axis=(0, 1))
+    path_samples = pixels * args.spp
+
+    results = {
+        'case': args.run_case,
+        'triangles': int(scene.triangle_number if scene.mesh_number > 1 else 0),
+        'spheres': scene.sphere_number - 1,
+        'quads': scene.quad_number - 1,
+        'primary_rays_per_s': primary_rays / primary_time,
+        'primary_triangle_tests_per_ray': primary[0] / primary_rays,
+        'primary_box_tests_per_ray': primary[1] / primary_rays,
+        'path_samples_per_s': path_samples / path_time,
+        'path_rays_per_s': paths[2] / path_time,
+        'rays_per_path': paths[2] / path_samples,
+        'path_triangle_tests_per_ray': paths[0] / paths[2],
+        'path_box_tests_per_ray': paths[1] / paths[2],
+        'blas_build_time': built['blas_build_time'],
+        'tlas_build_time': built['tlas_build_time'],
+        'triangle_buffer_mb': built['triangle_buffer_bytes'] / 2**20,
+        'triangle_record_mb': built['triangle_record_bytes'] / 2**20,
+        # ru_maxrss is in kilobytes on Linux, in bytes on macOS
+        'peak_memory_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2**20 if sys.platform == 'darwin' else 2**10),
+        'mean_radiance': float(color_buffer.to_numpy().mean() / args.spp),
+    }
+    with open(args.case_output, 'w') as f:
+        json.dump(results, f)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(args):
+    if args.run_case is not None:
+        return run_case(args)
+
+    import taichi as ti
+    results = []
+    for case in args.cases:
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'case.json')
+            command = [sys.executable, os.path.abspath(__file__), '--run-case', case, '--case-output', output,
+                       '--arch', args.arch, '--width', str(args.width), '--spp', str(args.spp),
+                       '--primary-launches', str(args.primary_launches)]
+            subprocess.run(command, check=True, cwd=ROOT, env=dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT, os.path.dirname(os.path.abspath(__file__))])))
+            with open(output) as f:
+                results.append(json.load(f))
+
+    print(f"{'case':<14} {'triangles':>9} {'primary rays/s':>15} {'box/ray':>8} {'tri/ray':>8} {'samples/s':>10} {'rays/path':>9} {'box/ray':>8} {'tri/ray':>8} {'blas s':>7} {'tlas s':>7} {'tri MB':>7} {'rec MB':>7} {'peak MB':>8}")
+    for r in results:
+        print(f"{r['case']:<14} {r['triangles']:>9} {r['primary_rays_per_s']:>15,.0f} {r['primary_box_tests_per_ray']:>8.1f} {r['primary_triangle_tests_per_ray']:>8.1f} "
+              f"{r['path_samples_per_s']:>10,.0f} {r['rays_per_path']:>9.2f} {r['path_box_tests_per_ray']:>8.1f} {r['path_triangle_tests_per_ray']:>8.1f} "
+              f"{r['blas_build_time']:>7.2f} {r['tlas_build_time']:>7.2f} {r['triangle_buffer_mb']:>7.2f} {r['triangle_record_mb']:>7.2f} {r['peak_memory_mb']:>8.0f}")
+
+    if args.json is not None:
+        report = {
+            'commit': git_commit(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'arch': args.arch,
+            'taichi': '.'.join(str(n) for n in ti.__version__),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'settings': {'width': args.width, 'spp': args.spp, 'primary_launches': args.primary_launches},
+            'results': results,
+        }
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"results written to {args.json}")
+    return results
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,214 @@
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+from bvh.obj_file_to_nparray import load_obj, normalize_mesh
+from bvh.sah_builder import build_bvh, thread_bvh, MAX_DEPTH, NUM_BINS, MIN_LEAF_SIZE
+from bvh.wide_bvh import collapse_bvh, BVH_WIDTH
+
+CACHE_VERSION = 3
+CACHE_DIR = 'meshes/cache'
+HASH_BLOCK_SIZE = 1 << 24
+
+# Same fields, in the same order, as models.triangle.Triangle and models.mesh.BVHNode
+TRIANGLE_DTYPE = np.dtype([
+    ('v0', '<f4', (3,)),
+    ('v1', '<f4', (3,)),
+    ('v2', '<f4', (3,)),
+    ('e1', '<f4', (3,)),
+    ('e2', '<f4', (3,)),
+    ('normal', '<f4', (3,)),
+    ('material_coord', '<i4', (2,)),
+])
+
+NODE_DTYPE = np.dtype([
+    ('boundingBox', [('min', '<f4', (3,)), ('max', '<f4', (3,))]),
+    ('childIndex', '<i4'),
+    ('triangleIndex', '<i4'),
+    ('triangleCount', '<i4'),
+    ('escapeIndex', '<i4'),
+])
+
+ARRAYS = ('vertices', 'faces', 'triangles', 'nodes', 'wide_nodes')
+
+
+def wide_node_dtype(width):
+    # Same fields as models.mesh.WideBVHNode
+    return np.dtype([(name, '<f4', (width,)) for name in ('minx', 'miny', 'minz', 'maxx', 'maxy', 'maxz')]
+                    + [('childIndex', '<i4', (width,)), ('triangleCount', '<i4', (width,))])
+
+
+def default_settings(box_size=400, num_bins=NUM_BINS, max_depth=MAX_DEPTH, min_leaf_size=MIN_LEAF_SIZE, bvh_width=BVH_WIDTH):
+    """Every parameter that changes the content of a mesh asset."""
+    return {'box_size': box_size, 'num_bins': num_bins, 'max_depth': max_depth, 'min_leaf_size': min_leaf_size, 'bvh_width': bvh_width}
+
+
+def asset_key(obj_file_path, settings):
+    """SHA-256 of the OBJ file content, of the build settings and of the cache version."""
+    sha = hashlib.sha256()
+    with open(obj_file_path, 'rb') as file:
+        while True:
+            block = file.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            sha.update(block)
+    sha.update(json.dumps(settings, sort_keys=True).encode())
+    sha.update(f"version={CACHE_VERSION}".encode())
+    return sha.hexdigest()
+
+
+def triangle_records(vertices, faces):
+    """Triangle records, with edges and normals precomputed, in the Triangle field layout."""
+    records = np.zeros(faces.shape[0], dtype=TRIANGLE_DTYPE)
+    v0, v1, v2 = vertices[faces[:, 0]], vertices[faces[:, 1]], vertices[faces[:, 2]]
+    e1 = v1 - v0
+    e2 = v2 - v0
+    normal = np.cross(e1, e2)
+    length = np.linalg.norm(normal, axis=1, keepdims=True)
+    records['v0'], records['v1'], records['v2'] = v0, v1, v2
+    records['e1'], records['e2'] = e1, e2
+    records['normal'] = normal / np.where(length > 0., length, 1.)
+    return records
+
+
+def node_records(nodes):
+    """Pack the dict of arrays of bvh.sah_builder into a single NODE_DTYPE array."""
+    records = np.zeros(nodes['childIndex'].shape[0], dtype=NODE_DTYPE)
+    records['boundingBox']['min'] = nodes['boundingBox']['min']
+    records['boundingBox']['max'] = nodes['boundingBox']['max']
+    for name in ('childIndex', 'triangleIndex', 'triangleCount', 'escapeIndex'):
+        records[name] = nodes[name]
+    return records
+
+
+def wide_node_records(wide_nodes):
+    """Pack the dict of arrays of bvh.wide_bvh into a single wide_node_dtype array."""
+    node_number, width = wide_nodes['childIndex'].shape
+    records = np.zeros(node_number, dtype=wide_node_dtype(width))
+    for name in records.dtype.names:
+        records[name] = wide_nodes[name]
+    return records
+
+
+def asset_header(asset, settings, key, source):
+    return {
+        'version': CACHE_VERSION,
+        'key': key,
+        'source': source,
+        'settings': settings,
+        'vertex_number': int(asset['vertices'].shape[0]),
+        'triangle_number': int(asset['faces'].shape[0]),
+        'node_number': int(asset['nodes'].shape[0]),
+    }
+
+
+def build_mesh_asset(obj_file_path, settings):
+    """Load, normalize and build the BVH of an OBJ file."""
+    vertices, faces = load_obj(obj_file_path)
+    return build_mesh_arrays(vertices, faces, settings)
+
+
+def build_mesh_arrays(vertices, faces, settings):
+    """Normalize and build the BVH of a mesh given by its vertex and face arrays."""
+    vertices = normalize_mesh(vertices, settings['box_size']).astype(np.float32)
+    nodes, order = build_bvh(vertices[faces], num_bins=settings['num_bins'],
+                             max_depth=settings['max_depth'], min_leaf_size=settings['min_leaf_size'])
+    nodes = thread_bvh(nodes)
+    faces = faces[order]
+    return {
+        'vertices': vertices,
+        'faces': faces,
+        'triangles': triangle_records(vertices, faces),
+        'nodes': node_records(nodes),
+        'wide_nodes': wide_node_records(collapse_bvh(nodes, settings['bvh_width'])),
+    }
+
+
+def save_mesh_asset(asset_dir, asset, header):
+    """
+    Write an asset as one .npy file per array plus a header.json.
+
+    Everything is written in a temporary directory which is then renamed, so
+    a reader never sees a half written asset.
+    """
+    tmp_dir = f"{asset_dir}.tmp-{os.getpid()}"
+    os.makedirs(tmp_dir, exist_ok=True)
+    for name in ARRAYS:
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), asset[name], allow_pickle=False)
+    with open(os.path.join(tmp_dir, 'header.json'), 'w') as file:
+        json.dump(header, file, indent=2)
+    try:
+        os.rename(tmp_dir, asset_dir)
+    except OSError:
+        # Another process saved the same asset in the meantime
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def read_mesh_asset(asset_dir):
+    """
+    Memory-map a saved asset.
+
+    Returns:
+        tuple: (header, arrays) or None if the directory does not hold a
+        complete asset of the current version.
+    """
+    try:
+        with open(os.path.join(asset_dir, 'header.json')) as file:
+            header = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if header.get('version') != CACHE_VERSION:
+        return None
+    arrays = {name: np.load(os.path.join(asset_dir, f"{name}.npy"), mmap_mode='r', allow_pickle=False) for name in ARRAYS}
+    return header, arrays
+
+
+def load_mesh_asset(obj_file_path, cache_dir=CACHE_DIR, **settings):
+    """
+    Mesh asset of an OBJ file, built only if it is not already in the cache.
+
+    The asset is stored under cache_dir in a directory named after the OBJ
+    file and a hash of its content and of the build settings, so editing the
+    mesh or changing a setting triggers a rebuild while everything else is
+    memory-mapped from disk without any pickle.
+
+    Parameters:
+        obj_file_path (str): Path of the OBJ file.
+        cache_dir (str): Directory holding the assets.
+        settings: Overrides of default_settings (box_size, num_bins, ...).
+
+    Returns:
+        tuple: (header, arrays) where arrays holds 'vertices', 'faces',
+        'triangles' (TRIANGLE_DTYPE) and 'nodes' (NODE_DTYPE).
+    """
+    settings = default_settings(**settings)
+    key = asset_key(obj_file_path, settings)
+    name = os.path.splitext(os.path.basename(obj_file_path))[0]
+    asset_dir = os.path.join(cache_dir, f"{name}_{key[:16]}")
+
+    cached = read_mesh_asset(asset_dir)
+    if cached is not None:
+        return cached
+
+    asset = build_mesh_asset(obj_file_path, settings)
+    header = asset_header(asset, settings, key, obj_file_path)
+    os.makedirs(cache_dir, exist_ok=True)
+    # An unreadable directory under this name is a stale asset
+    shutil.rmtree(asset_dir, ignore_errors=True)
+    save_mesh_asset(asset_dir, asset, header)
+    return read_mesh_asset(asset_dir)
+
+
+def mesh_asset_from_arrays(vertices, faces, **settings):
+    """
+    Mesh asset of a mesh built in memory, e.g. a procedural one.
+
+    The BVH is built every time, nothing goes through the cache.
+
+    Returns:
+        tuple: (header, arrays), the same as load_mesh_asset.
+    """
+    settings = default_settings(**settings)
+    asset = build_mesh_arrays(np.asarray(vertices, dtype=np.float32), np.asarray(faces, dtype=np.int32), settings)
+    return asset_header(asset, settings, None, 'memory'), asset
@@ -1,46 +1,145 @@
 import numpy as np
 from bvh.classes import Triangle
 
-def read_obj_file(file_path):
+CHUNK_SIZE = 1 << 24
+
+_NEWLINE = ord('\n')
+_SLASH = ord('/')
+_WHITESPACE = np.zeros(256, dtype=bool)
+_WHITESPACE[[ord(' '), ord('\t'), ord('\r'), ord('\n'), ord('\v'), ord('\f')]] = True
+
+
+def _line_tokens(data, line_starts):
+    """Token count of every line of data, with the whitespace and token start masks."""
+    is_space = _WHITESPACE[data]
+    token_start = ~is_space
+    token_start[1:] &= is_space[:-1]
+    return np.add.reduceat(token_start, line_starts, dtype=np.int64), is_space, token_start
+
+
+def _first_columns(values, tokens_per_line, columns):
+    """Keep the first columns values of every line of a flat token array."""
+    if np.all(tokens_per_line == columns):
+        return values.reshape(-1, columns)
+    offsets = np.cumsum(tokens_per_line) - tokens_per_line
+    return values[offsets[:, None] + np.arange(columns)]
+
+
+def _parse_chunk(chunk, vertex_offset):
+    """
+    Parse the 'v' and 'f' records of a block of complete lines.
+
+    Every line is classified from its first two bytes, then the bytes of the
+    vertex lines and of the face lines are gathered and handed to
+    np.fromstring. For faces, the '/vt/vn' part of every token is blanked
+    beforehand so only vertex indices are read.
+
+    Returns:
+        tuple: (vertices, faces) where faces is already fan-triangulated and
+        0-based in the global vertex numbering.
+    """
+    buf = np.frombuffer(chunk, dtype=np.uint8)
+    line_ends = np.flatnonzero(buf == _NEWLINE)
+    line_starts = np.concatenate(([0], line_ends[:-1] + 1))
+    line_lengths = line_ends - line_starts + 1
+    # Lengths once the keyword byte has been dropped
+    data_lengths = line_lengths - 1
+
+    second = buf[np.minimum(line_starts + 1, buf.shape[0] - 1)]
+    has_keyword = _WHITESPACE[second] & (line_lengths > 1)
+    is_v = has_keyword & (buf[line_starts] == ord('v'))
+    is_f = has_keyword & (buf[line_starts] == ord('f'))
+
+    # Vertices
+    mask = np.repeat(is_v, line_lengths)
+    mask[line_starts] = False
+    v_data = buf[mask]
+    v_line_starts = np.cumsum(data_lengths[is_v]) - data_lengths[is_v]
+    vertices = np.zeros((0, 3), dtype=np.float32)
+    if v_data.shape[0] > 0:
+        tokens_per_line, _, _ = _line_tokens(v_data, v_line_starts)
+        values = np.fromstring(v_data.tobytes(), dtype=np.float32, sep=' ')
+        vertices = _first_columns(values, tokens_per_line, 3)
+
+    # Faces
+    mask = np.repeat(is_f, line_lengths)
+    mask[line_starts] = False
+    f_data = buf[mask]
+    f_line_starts = np.cumsum(data_lengths[is_f]) - data_lengths[is_f]
+    faces = np.zeros((0, 3), dtype=np.int32)
+    if f_data.shape[0] > 0:
+        tokens_per_line, is_space, token_start = _line_tokens(f_data, f_line_starts)
+
+        # Blank everything from the first '/' of a token to its end : v/vt/vn -> v
+        slashes = np.cumsum(f_data == _SLASH, dtype=np.int32)
+        token_base = np.maximum.accumulate(np.where(token_start, slashes, 0))
+        f_data[~is_space & (slashes > token_base)] = ord(' ')
+        indices = np.fromstring(f_data.tobytes(), dtype=np.int64, sep=' ')
+
+        # Negative indices are relative to the vertices read so far
+        vertices_before = vertex_offset + (np.cumsum(is_v) - is_v)[is_f]
+        indices = np.where(indices < 0, np.repeat(vertices_before, tokens_per_line) + indices, indices - 1)
+
+        # Fan triangulation of n-gons : (0, j+1, j+2) for j in [0, n-3]
+        polygons = tokens_per_line >= 3
+        offsets = (np.cumsum(tokens_per_line) - tokens_per_line)[polygons]
+        triangle_per_polygon = tokens_per_line[polygons] - 2
+        first = np.repeat(offsets, triangle_per_polygon)
+        j = np.arange(first.shape[0]) - np.repeat(np.cumsum(triangle_per_polygon) - triangle_per_polygon, triangle_per_polygon)
+        faces = np.stack((indices[first], indices[first + j + 1], indices[first + j + 2]), axis=1).astype(np.int32)
+
+    return vertices, faces
+
+
+def load_obj(file_path, chunk_size=CHUNK_SIZE):
+    """
+    Load the vertices and the faces of an OBJ file.
+
+    The file is read in blocks of chunk_size bytes which are parsed with NumPy,
+    so no Python object is created per vertex or per face. Faces can be given
+    as 'v', 'v/vt', 'v//vn' or 'v/vt/vn', with negative indices, and n-gons are
+    fan-triangulated.
+
+    Parameters:
+        file_path (str): Path of the OBJ file.
+        chunk_size (int): Size of the blocks read from the file.
+
+    Returns:
+        tuple: (vertices, faces), a (V, 3) float32 vertex buffer and a (F, 3)
+        int32 array of 0-based vertex indices.
+    """
     vertices = []
-    triangles = []
-
-    with open(file_path, 'r') as file:
-        for line in file:
-            if line.startswith('v '):
-                # Parse vertex
-                _, x, y, z = line.split()
-                vertices.append((float(x), float(y), float(z)))
-
-            n = len(vertices)
-            if line.startswith('f '):
-                    a, b, c = parse_face_line(line)
-                    v1 = a - (a > 1)
-                    v2 = b - (b > 1)
-                    v3 = c - (c > 1)
-                    triangles.append([vertices[v1], vertices[v2], vertices[v3]])
-
-    return np.array(vertices), np.array(triangles)
-
-def parse_face_line(face_line):
-    # Split the face line by spaces, ignoring the first 'f'
-    vertices = face_line.split()[1:]
+    faces = []
+    vertex_number = 0
+    leftover = b''
+
+    with open(file_path, 'rb') as file:
+        while True:
+            block = file.read(chunk_size)
+            if not block:
+                break
+            block = leftover + block
+            end = block.rfind(b'\n') + 1
+            leftover = block[end:]
+            if end > 0:
+                v, f = _parse_chunk(block[:end], vertex_number)
+                vertices.append(v)
+                faces.append(f)
+                vertex_number += v.shape[0]
+    if leftover:
+        v, f = _parse_chunk(leftover + b'\n', vertex_number)
+        vertices.append(v)
+        faces.append(f)
+
+    vertices = np.concatenate(vertices) if vertices else np.zeros((0, 3), dtype=np.float32)
+    faces = np.concatenate(faces) if faces else np.zeros((0, 3), dtype=np.int32)
+    return vertices, faces
 
-    parsed_faces = []
 
-    # Loop through each vertex definition in the face line
-    for vertex in vertices:
-        # Split by the '/' to get vertex, texture, and normal indices
-        v, _, _ = vertex.split('/')
-
-        # Convert the indices to integers (note: OBJ uses 1-based indices)
-        # Negative indices refer to the end of the list, which is why they can stay negative
-        v = int(v)
-
-        # Store the parsed indices in a tuple
-        parsed_faces.append(v)
-
-    return parsed_faces
+def read_obj_file(file_path):
+    """Vertices and de-indexed (F, 3, 3) triangles of an OBJ file."""
+    vertices, faces = load_obj(file_path)
+    return vertices, vertices[faces]
 
 
 def normalize_mesh(mesh, box_size=400):
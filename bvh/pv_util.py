@@ -194,3 +194,24 @@ def draw_BVH_efficient(plotter, allNodes):
             box_max = node.boundingBox.max
             boxes.append({'box_min':box_min, 'box_max':box_max})
     draw_boxes(plotter, boxes)
+
+def draw_BVH_arrays(plotter, nodes):
+    # Same as draw_BVH_efficient for the dict of arrays built by bvh.sah_builder
+    leaves = nodes['childIndex'] == 0
+    boxes = [{'box_min':box_min, 'box_max':box_max} for box_min, box_max in zip(nodes['boundingBox']['min'][leaves], nodes['boundingBox']['max'][leaves])]
+    draw_boxes(plotter, boxes)
+
+def plot_triangle_array(plotter, triangles, highlight_index=None):
+    # Same as plot_triangles for a (N, 3, 3) array of vertices
+    triangle_number = triangles.shape[0]
+    vertices = triangles.reshape(-1, 3)
+    faces = np.column_stack((np.full(triangle_number, 3), np.arange(3*triangle_number).reshape(-1, 3))).ravel()
+
+    mesh = pv.PolyData(vertices, faces)
+
+    colors = np.ones((triangle_number, 3)) * [0.623, 0.80, 0.84]
+    if highlight_index is not None and highlight_index >= 0:
+        colors[highlight_index] = [1, 0, 0]
+    mesh.cell_data['colors'] = colors
+
+    plotter.add_mesh(mesh, scalars='colors', opacity=0.8, rgb=True)
@@ -0,0 +1,274 @@
+import numpy as np
+
+MAX_DEPTH = 32
+NUM_BINS = 16
+MIN_LEAF_SIZE = 2
+
+
+def triangle_bounds(triangles):
+    """
+    Precompute the AABB and the centroid of every triangle.
+
+    Parameters:
+        triangles (np.ndarray): (N, 3, 3) array of triangle vertices.
+
+    Returns:
+        tuple: (mins, maxs, centroids), each a (N, 3) float32 array.
+    """
+    mins = triangles.min(axis=1)
+    maxs = triangles.max(axis=1)
+    centroids = triangles.mean(axis=1, dtype=np.float32)
+    return mins, maxs, centroids
+
+
+def surface_area(mins, maxs):
+    """Surface area of one or several boxes, 0 for empty boxes."""
+    extent = np.maximum(maxs - mins, 0.)
+    return 2.0 * (extent[..., 0]*extent[..., 1] + extent[..., 1]*extent[..., 2] + extent[..., 2]*extent[..., 0])
+
+
+def empty_nodes(node_number):
+    """Node arrays with the same layout as models.mesh.BVHNode.to_numpy()."""
+    return {
+        'boundingBox': {
+            'min': np.zeros((node_number, 3), dtype=np.float32),
+            'max': np.zeros((node_number, 3), dtype=np.float32),
+        },
+        'childIndex': np.zeros(node_number, dtype=np.int32),
+        'triangleIndex': np.zeros(node_number, dtype=np.int32),
+        'triangleCount': np.zeros(node_number, dtype=np.int32),
+    }
+
+
+def _segment_offsets(counts):
+    offsets = np.zeros(counts.shape[0], dtype=np.int64)
+    np.cumsum(counts[:-1], out=offsets[1:])
+    return offsets
+
+
+def _best_splits(seg, offsets, tri_min, tri_max, centroids, num_bins):
+    """
+    Binned SAH evaluation of every axis of every node of a level at once.
+
+    Triangles are given segment by segment (seg is the node slot of each
+    triangle, offsets the first triangle of each slot). Each triangle is binned
+    along x, y and z according to its centroid, all the bins of the level are
+    reduced in a single bincount/ufunc.at pass and prefix/suffix sweeps give
+    the cost of the num_bins-1 candidate planes of each axis.
+
+    Returns:
+        tuple: (cost, axis, split_bin, bins, left_bounds, right_bounds), one
+        entry per node slot ; cost is inf when a node cannot be split.
+    """
+    node_number = offsets.shape[0]
+    counts = np.diff(np.append(offsets, seg.shape[0]))
+
+    c_min = np.minimum.reduceat(centroids, offsets, axis=0)
+    c_extent = np.maximum.reduceat(centroids, offsets, axis=0) - c_min
+    splittable = c_extent > 0.
+
+    scale = np.where(splittable, num_bins / np.where(splittable, c_extent, 1.), 0.).astype(np.float32)
+    bins = ((centroids - c_min[seg]) * scale[seg]).astype(np.int32)
+    np.minimum(bins, num_bins - 1, out=bins)
+
+    # One flat key per (node, axis, bin) so the whole level is reduced in one pass
+    keys = (bins + (seg[:, None]*3 + np.arange(3))*num_bins).ravel()
+    bin_number = node_number*3*num_bins
+    bin_count = np.bincount(keys, minlength=bin_number).reshape(node_number, 3, num_bins)
+
+    # Bin bounds are kept component first, (3, nodes, axes, bins), for fast 1D ufunc.at
+    bin_min = np.full((3, bin_number), np.inf, dtype=np.float32)
+    bin_max = np.full((3, bin_number), -np.inf, dtype=np.float32)
+    for c in range(3):
+        np.minimum.at(bin_min[c], keys, np.repeat(tri_min[:, c], 3))
+        np.maximum.at(bin_max[c], keys, np.repeat(tri_max[:, c], 3))
+    bin_min = bin_min.reshape(3, node_number, 3, num_bins)
+    bin_max = bin_max.reshape(3, node_number, 3, num_bins)
+
+    # Left side of plane i holds bins [0, i], right side bins [i+1, num_bins-1]
+    left_min = np.minimum.accumulate(bin_min, axis=3)[..., :-1]
+    left_max = np.maximum.accumulate(bin_max, axis=3)[..., :-1]
+    right_min = np.minimum.accumulate(bin_min[..., ::-1], axis=3)[..., ::-1][..., 1:]
+    right_max = np.maximum.accumulate(bin_max[..., ::-1], axis=3)[..., ::-1][..., 1:]
+    left_min, left_max, right_min, right_max = (np.moveaxis(b, 0, -1) for b in (left_min, left_max, right_min, right_max))
+
+    left_count = np.cumsum(bin_count, axis=2)[:, :, :-1]
+    right_count = counts[:, None, None] - left_count
+
+    cost = left_count*surface_area(left_min, left_max) + right_count*surface_area(right_min, right_max)
+    cost[(left_count == 0) | (right_count == 0) | ~splittable[:, :, None]] = np.inf
+
+    best = np.argmin(cost.reshape(node_number, -1), axis=1)
+    axis, split_bin = np.unravel_index(best, cost.shape[1:])
+    slots = np.arange(node_number)
+    left_bounds = (left_min[slots, axis, split_bin], left_max[slots, axis, split_bin])
+    right_bounds = (right_min[slots, axis, split_bin], right_max[slots, axis, split_bin])
+    return cost[slots, axis, split_bin], axis, split_bin, bins, left_bounds, right_bounds
+
+
+def build_bvh(triangles, num_bins=NUM_BINS, max_depth=MAX_DEPTH, min_leaf_size=MIN_LEAF_SIZE):
+    """
+    Build a BVH over a flat triangle array with binned SAH.
+
+    Parameters:
+        triangles (np.ndarray): (N, 3, 3) array of triangle vertices.
+        num_bins (int): Number of SAH bins per axis.
+        max_depth (int): Depth after which nodes are always leaves.
+        min_leaf_size (int): Nodes with fewer triangles are not split.
+
+    Returns:
+        tuple: (nodes, order) as returned by build_bvh_from_bounds.
+    """
+    triangles = np.asarray(triangles, dtype=np.float32)
+    tri_min, tri_max, centroids = triangle_bounds(triangles)
+    return build_bvh_from_bounds(tri_min, tri_max, centroids, num_bins, max_depth, min_leaf_size)
+
+
+def build_bvh_from_bounds(tri_min, tri_max, centroids, num_bins=NUM_BINS, max_depth=MAX_DEPTH, min_leaf_size=MIN_LEAF_SIZE):
+    """
+    Build a BVH over primitives given by their AABB and centroid, with binned SAH.
+
+    The tree is built one depth level at a time on an index permutation: all
+    the nodes of a level are binned, evaluated and partitioned together, so
+    nothing is done per primitive or per node in Python. Children of a node
+    are stored next to each other, at childIndex and childIndex+1, and a leaf
+    has childIndex == 0, which is the layout models.mesh.BVHNode expects.
+
+    Parameters:
+        tri_min, tri_max, centroids (np.ndarray): (N, 3) float32 arrays.
+        num_bins (int): Number of SAH bins per axis.
+        max_depth (int): Depth after which nodes are always leaves.
+        min_leaf_size (int): Nodes with fewer primitives are not split.
+
+    Returns:
+        tuple: (nodes, order) where nodes is a dict of arrays that can be given
+        to BVHNode.field.from_numpy and order is the permutation to apply to the
+        primitives (triangles[order]) so that leaves reference contiguous ranges.
+    """
+    tri_min, tri_max, centroids = (np.asarray(a, dtype=np.float32) for a in (tri_min, tri_max, centroids))
+    triangle_number = tri_min.shape[0]
+
+    nodes = empty_nodes(max(2*triangle_number - 1, 1))
+    bbox_min = nodes['boundingBox']['min']
+    bbox_max = nodes['boundingBox']['max']
+    childIndex = nodes['childIndex']
+    triangleIndex = nodes['triangleIndex']
+    triangleCount = nodes['triangleCount']
+
+    order = np.arange(triangle_number, dtype=np.int64)
+    if triangle_number > 0:
+        bbox_min[0] = tri_min.min(axis=0)
+        bbox_max[0] = tri_max.max(axis=0)
+    triangleCount[0] = triangle_number
+    nodeIndex = 1
+
+    level = np.zeros(1, dtype=np.int64)
+    for depth in range(max_depth):
+        level = level[triangleCount[level] >= min_leaf_size]
+        if level.shape[0] == 0:
+            break
+
+        starts = triangleIndex[level].astype(np.int64)
+        counts = triangleCount[level].astype(np.int64)
+        offsets = _segment_offsets(counts)
+        seg = np.repeat(np.arange(level.shape[0]), counts)
+        positions = np.arange(seg.shape[0]) - offsets[seg] + starts[seg]
+        indices = order[positions]
+
+        # Small nodes do not need more bins than they have triangles
+        level_bins = int(min(num_bins, max(counts.max(), 2)))
+        cost, axis, split_bin, bins, left_bounds, right_bounds = _best_splits(
+            seg, offsets, tri_min[indices], tri_max[indices], centroids[indices], level_bins)
+
+        parentCost = counts*surface_area(bbox_min[level], bbox_max[level])
+        split = cost < parentCost
+        if not split.any():
+            break
+
+        # Stable partition of every split segment : side A first, then side B
+        isSideA = bins[np.arange(seg.shape[0]), axis[seg]] <= split_bin[seg]
+        rankA = np.cumsum(isSideA) - 1
+        rankB = np.cumsum(~isSideA) - 1
+        countA = np.add.reduceat(isSideA, offsets).astype(np.int64)
+        firstA = rankA[offsets] + 1 - isSideA[offsets]
+        firstB = rankB[offsets] + isSideA[offsets]
+        new_positions = np.where(
+            isSideA,
+            starts[seg] + rankA - firstA[seg],
+            starts[seg] + countA[seg] + rankB - firstB[seg])
+        moved = split[seg]
+        order[new_positions[moved]] = indices[moved]
+
+        parents = level[split]
+        childA = nodeIndex + 2*np.arange(parents.shape[0])
+        childB = childA + 1
+        nodeIndex += 2*parents.shape[0]
+        childIndex[parents] = childA
+
+        bbox_min[childA] = left_bounds[0][split]
+        bbox_max[childA] = left_bounds[1][split]
+        triangleIndex[childA] = starts[split]
+        triangleCount[childA] = countA[split]
+
+        bbox_min[childB] = right_bounds[0][split]
+        bbox_max[childB] = right_bounds[1][split]
+        triangleIndex[childB] = starts[split] + countA[split]
+        triangleCount[childB] = counts[split] - countA[split]
+
+        level = np.stack((childA, childB), axis=1).ravel()
+
+    nodes = {
+        'boundingBox': {'min': bbox_min[:nodeIndex], 'max': bbox_max[:nodeIndex]},
+        'childIndex': childIndex[:nodeIndex],
+        'triangleIndex': triangleIndex[:nodeIndex],
+        'triangleCount': triangleCount[:nodeIndex],
+    }
+    return nodes, order
+
+
+def thread_bvh(nodes):
+    """
+    Renumber a BVH in depth-first order and add escape (skip) links.
+
+    Siblings stay next to each other, at childIndex and childIndex+1, so the
+    stack traversal still works on the result. The escapeIndex of a node is
+    the next node to visit once its subtree is done or skipped: the right
+    sibling for a left child, the parent's escapeIndex for a right child, -1
+    at the end of the tree. This is what the stackless traversal of
+    models.mesh.Mesh follows.
+
+    Parameters:
+        nodes (dict): Node arrays as returned by build_bvh.
+
+    Returns:
+        dict: The renumbered node arrays, with an extra 'escapeIndex' array.
+    """
+    node_number = nodes['childIndex'].shape[0]
+    child = nodes['childIndex'].tolist()
+    new_index = [0] * node_number
+    escape = [-1] * node_number
+    nodeIndex = 1
+
+    # (old index, escape index in the new numbering)
+    stack = [(0, -1)]
+    while stack:
+        node, node_escape = stack.pop()
+        escape[new_index[node]] = node_escape
+        childA = child[node]
+        if childA != 0:
+            new_index[childA] = nodeIndex
+            new_index[childA + 1] = nodeIndex + 1
+            stack.append((childA + 1, node_escape))
+            stack.append((childA, nodeIndex + 1))
+            nodeIndex += 2
+
+    new_index = np.array(new_index, dtype=np.int64)
+    threaded = empty_nodes(node_number)
+    threaded['boundingBox']['min'][new_index] = nodes['boundingBox']['min']
+    threaded['boundingBox']['max'][new_index] = nodes['boundingBox']['max']
+    threaded['triangleIndex'][new_index] = nodes['triangleIndex']
+    threaded['triangleCount'][new_index] = nodes['triangleCount']
+    isLeaf = nodes['childIndex'] == 0
+    threaded['childIndex'][new_index] = np.where(isLeaf, 0, new_index[nodes['childIndex']])
+    threaded['escapeIndex'] = np.array(escape, dtype=np.int32)
+    return threaded
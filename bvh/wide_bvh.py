@@ -0,0 +1,82 @@
+import numpy as np
+from bvh.sah_builder import surface_area
+from constants import BVH_WIDTH
+
+
+def empty_wide_nodes(node_number, width=BVH_WIDTH):
+    """Node arrays with the same layout as models.mesh.WideBVHNode.to_numpy()."""
+    nodes = {name: np.full((node_number, width), np.inf, dtype=np.float32) for name in ('minx', 'miny', 'minz')}
+    nodes.update({name: np.full((node_number, width), -np.inf, dtype=np.float32) for name in ('maxx', 'maxy', 'maxz')})
+    nodes['childIndex'] = np.zeros((node_number, width), dtype=np.int32)
+    nodes['triangleCount'] = np.full((node_number, width), -1, dtype=np.int32)
+    return nodes
+
+
+def collapse_bvh(nodes, width=BVH_WIDTH):
+    """
+    Collapse a binary BVH into a BVH4/BVH8.
+
+    Every wide node starts from the two children of a binary node and, while
+    it has free slots, replaces its internal child of largest surface area by
+    that child's two children. Child bounds are stored SoA, one array per
+    coordinate, so a traversal can test every child box of a node at once.
+
+    A slot k of a wide node is a leaf when triangleCount[k] > 0 (childIndex[k]
+    is then the first triangle), an internal node when triangleCount[k] == 0
+    (childIndex[k] is the wide node index) and empty when triangleCount[k] is -1.
+
+    Parameters:
+        nodes (dict): Binary node arrays as returned by build_bvh or thread_bvh.
+        width (int): Number of children per wide node.
+
+    Returns:
+        dict: Wide node arrays, the root is node 0.
+    """
+    child = nodes['childIndex'].tolist()
+    area = surface_area(nodes['boundingBox']['min'], nodes['boundingBox']['max']).tolist()
+
+    all_slots = []
+    # Binary node each wide node was made from, in wide node order
+    sources = []
+    stack = [0]
+    while stack:
+        node = stack.pop()
+        sources.append(node)
+        if child[node] == 0:
+            # The whole tree is a single leaf
+            slots = [node]
+        else:
+            slots = [child[node], child[node] + 1]
+        while len(slots) < width:
+            best = -1
+            for k, slot in enumerate(slots):
+                if child[slot] != 0 and (best < 0 or area[slot] > area[slots[best]]):
+                    best = k
+            if best < 0:
+                break
+            slot = slots.pop(best)
+            slots.extend((child[slot], child[slot] + 1))
+
+        all_slots.append(slots + [-1] * (width - len(slots)))
+        # Pushed in reverse so wide nodes are numbered depth first
+        stack.extend(slot for slot in reversed(slots) if child[slot] != 0)
+
+    slots = np.array(all_slots, dtype=np.int64).reshape(-1, width)
+    wide_index = np.zeros(nodes['childIndex'].shape[0], dtype=np.int32)
+    wide_index[sources] = np.arange(len(sources))
+
+    wide = empty_wide_nodes(slots.shape[0], width)
+    valid = slots >= 0
+    source = slots[valid]
+    isLeaf = nodes['childIndex'][source] == 0
+    bbox_min = nodes['boundingBox']['min'][source]
+    bbox_max = nodes['boundingBox']['max'][source]
+    for axis, name in enumerate('xyz'):
+        wide[f"min{name}"][valid] = bbox_min[:, axis]
+        wide[f"max{name}"][valid] = bbox_max[:, axis]
+    wide['childIndex'][valid] = np.where(isLeaf, nodes['triangleIndex'][source], wide_index[source])
+    # The root leaf of an empty mesh has no triangle, its slot is empty
+    # rather than an internal node pointing back at the root
+    leaf_count = nodes['triangleCount'][source]
+    wide['triangleCount'][valid] = np.where(isLeaf, np.where(leaf_count > 0, leaf_count, -1), 0)
+    return wide
@@ -1,7 +1,21 @@
 import taichi as ti
 
 MAX_LEN = 10e8
-MAX_BOUNCE = 6
+MAX_BOUNCE = 16
 PI = 3.1415926535
 EPS = 5e-4
 MAX_STACK_SIZE = 100
+BVH_WIDTH = 4
+# Russian roulette starts once a path has bounced RR_START_DEPTH times
+RR_START_DEPTH = 3
+RR_MAX_SURVIVAL = 0.95
+# Direct light sampling of the DiffuseLight spheres and quads, with MIS
+NEXT_EVENT_ESTIMATION = True
+# Relative distance under which a shadow ray hit is the sampled light itself
+SHADOW_EPS = 1e-3
+# Lambertian scatter follows the cosine lobe, uniform on the hemisphere when False
+COSINE_SAMPLING = True
+# Sample sequence of the paths : 'random', 'sobol', 'r2' or 'blue_noise', see utils/sampler.py
+SAMPLER = 'sobol'
+# Per pixel counters, traversal stack depth and stage timings of utils/stats.py, compiled out when False
+STATS = False
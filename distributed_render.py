@@ -0,0 +1,197 @@
+"""
+Distributed renderer : splits the samples of a render between worker
+processes and merges their accumulation buffers.
+
+    python distributed_render.py scenes.la_valse_cornellbox --workers 4 --spp 1024 -o la_valse.png
+
+Every worker renders a contiguous range of sample numbers of the whole image
+and writes its float accumulation to a memory-mapped .npy file of the shard
+directory. The samples only depend on their pixel, sample number and seed, so
+the merged image is the one a single process would render, whatever the
+number of workers.
+
+On several nodes sharing a directory, every node renders its own shard and
+one of them merges them :
+
+    python distributed_render.py scenes.la_valse_cornellbox --workers 8 --rank 3 --shard-dir /shared/la_valse
+    python distributed_render.py scenes.la_valse_cornellbox --workers 8 --merge --shard-dir /shared/la_valse -o la_valse.png
+"""
+import argparse
+import importlib
+import multiprocessing
+import os
+import time
+import numpy as np
+from offline_render import ARCHS, FORMATS, module_name, save_image, paint_samples_kernel
+from utils.tone_mapping import TONE_MAPPINGS
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Render a scene with several processes and merge their samples.")
+    parser.add_argument('scene', help="scene module, e.g. scenes.la_valse_cornellbox or scenes/la_valse_cornellbox.py")
+    parser.add_argument('--fragment', default='fragments.raytrace_frag', help="fragment module (default: fragments.raytrace_frag)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="number of shards, one worker process each (default: number of cores)")
+    parser.add_argument('--threads-per-worker', type=int, default=None, help="cpu threads of every worker (default: cores / workers)")
+    parser.add_argument('--rank', type=int, default=None, help="only render this shard, for multi-node renders")
+    parser.add_argument('--merge', action='store_true', help="only merge the shards already rendered")
+    parser.add_argument('--shard-dir', default=None, help="directory of the shard buffers (default: the output name with .shards)")
+    parser.add_argument('--arch', choices=ARCHS, default='cpu', help="taichi backend of the workers (default: cpu)")
+    parser.add_argument('--spp', type=int, default=64, help="samples per pixel of the whole render (default: 64)")
+    parser.add_argument('--spp-per-launch', type=int, default=8, help="samples per pixel traced by each kernel launch (default: 8)")
+    parser.add_argument('-o', '--output', default='render.png', help="output file (default: render.png)")
+    parser.add_argument('--format', choices=FORMATS, default=None, help="output format (default: from the output extension)")
+    parser.add_argument('--gamma', type=float, default=2.2, help="gamma of the png output (default: 2.2)")
+    parser.add_argument('--exposure', type=float, default=1., help="exposure of the png output (default: 1)")
+    parser.add_argument('--tonemap', choices=TONE_MAPPINGS, default='none', help="tone mapping of the png output (default: none)")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the sample sequences")
+    args = parser.parse_args(argv)
+
+    if args.format is None:
+        extension = os.path.splitext(args.output)[1][1:].lower()
+        if extension not in FORMATS:
+            parser.error(f"cannot infer the format of {args.output}, use --format")
+        args.format = extension
+    if args.workers < 1 or args.spp < args.workers:
+        parser.error("--workers must be between 1 and --spp")
+    if args.rank is not None and not 0 <= args.rank < args.workers:
+        parser.error("--rank must be in [0, --workers)")
+    if args.shard_dir is None:
+        args.shard_dir = os.path.splitext(args.output)[0] + '.shards'
+    if args.threads_per_worker is None:
+        args.threads_per_worker = max(1, (os.cpu_count() or 1) // args.workers)
+    return args
+
+
+def sample_range(rank, workers, spp):
+    """First sample and number of samples of a shard, the ranges of all the shards cover [0, spp)."""
+    first = spp * rank // workers
+    return first, spp * (rank + 1) // workers - first
+
+
+def shard_paths(shard_dir, rank):
+    # The info file (first sample, samples, compile time, render time) is
+    # written after the buffer, it marks a finished shard
+    return os.path.join(shard_dir, f"shard_{rank}.npy"), os.path.join(shard_dir, f"shard_{rank}_info.npy")
+
+
+def render_shard(args, rank):
+    """Render the samples of one shard into its memory-mapped accumulation buffer."""
+    import taichi as ti
+    buffer_path, info_path = shard_paths(args.shard_dir, rank)
+    if os.path.exists(info_path):
+        os.remove(info_path)
+    if args.arch == 'cpu':
+        ti.init(arch=ti.cpu, cpu_max_num_threads=args.threads_per_worker)
+    else:
+        ti.init(arch=getattr(ti, ARCHS[args.arch]))
+    scene_module = importlib.import_module(module_name(args.scene))
+    fragment = importlib.import_module(module_name(args.fragment)).fragment
+    from utils import stats
+
+    scene, cam = scene_module.scene, scene_module.cam
+    res = cam.resolution
+    color_buffer = ti.Vector.field(3, dtype=ti.f32, shape=res)
+    stats.allocate(res)
+    # The kernel of offline_render, so the merged image is the one it renders
+    paint = paint_samples_kernel(color_buffer, cam, scene, fragment)
+
+    first, spp = sample_range(rank, args.workers, args.spp)
+    compile_start = time.perf_counter()
+    paint(1, first, args.seed)
+    ti.sync()
+    compile_time = time.perf_counter() - compile_start
+
+    start = time.perf_counter()
+    samples = 1
+    while samples < spp:
+        spp_per_launch = min(args.spp_per_launch, spp - samples)
+        paint(spp_per_launch, first + samples, args.seed)
+        samples += spp_per_launch
+    ti.sync()
+    render_time = time.perf_counter() - start
+
+    os.makedirs(args.shard_dir, exist_ok=True)
+    buffer = np.lib.format.open_memmap(buffer_path, mode='w+', dtype=np.float32, shape=(res[0], res[1], 3))
+    buffer[:] = color_buffer.to_numpy()
+    buffer.flush()
+    del buffer
+    np.save(info_path, np.array([first, spp, compile_time, render_time]))
+    print(f"shard {rank} : samples {first}-{first + spp - 1} in {render_time:.2f}s (+{compile_time:.2f}s compilation)")
+
+
+def merge_shards(args):
+    """
+    Sum the accumulation buffers of all the shards.
+
+    Returns:
+        tuple: (sum of all the samples as a (width, height, 3) float64 array,
+        samples per pixel, info array of every shard)
+    """
+    total = None
+    infos = []
+    for rank in range(args.workers):
+        buffer_path, info_path = shard_paths(args.shard_dir, rank)
+        if not os.path.exists(info_path):
+            raise SystemExit(f"shard {rank} is not rendered yet, {info_path} is missing")
+        info = np.load(info_path)
+        if tuple(info[:2].astype(int)) != sample_range(rank, args.workers, args.spp):
+            raise SystemExit(f"shard {rank} was rendered for another --workers or --spp")
+        buffer = np.load(buffer_path, mmap_mode='r')
+        total = buffer.astype(np.float64) if total is None else total + buffer
+        infos.append(info)
+    infos = np.array(infos)
+    return total, int(infos[:, 1].sum()), infos
+
+
+def write_output(args, total, samples):
+    if args.format == 'png':
+        # Same 8-bit encoding as offline_render, on a cpu taichi runtime
+        import taichi as ti
+        from utils.tone_mapping import ToneMapper
+        ti.init(arch=ti.cpu)
+        color_buffer = ti.Vector.field(3, dtype=ti.f32, shape=total.shape[:2])
+        color_buffer.from_numpy(total.astype(np.float32))
+        tone_mapper = ToneMapper(total.shape[:2], tone_mapping=args.tonemap, exposure=args.exposure, gamma=args.gamma)
+        tone_mapper.develop(color_buffer, samples)
+        save_image(tone_mapper.image(), args.output, args.format)
+    else:
+        save_image(np.rot90(total / samples, k=1).astype(np.float32), args.output, args.format)
+
+
+def render(args):
+    """
+    Render, merge and write the output, as selected by --rank and --merge.
+
+    Returns:
+        dict: Wall time, slowest shard render time and samples of the run, None for a single --rank.
+    """
+    if args.rank is not None:
+        render_shard(args, args.rank)
+        return None
+
+    start = time.perf_counter()
+    if not args.merge:
+        # Taichi runtimes do not survive a fork, every worker starts a fresh interpreter
+        context = multiprocessing.get_context('spawn')
+        workers = [context.Process(target=render_shard, args=(args, rank)) for rank in range(args.workers)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        failed = [rank for rank, worker in enumerate(workers) if worker.exitcode != 0]
+        if failed:
+            raise SystemExit(f"shards {failed} failed")
+    total, samples, infos = merge_shards(args)
+    write_output(args, total, samples)
+    wall_time = time.perf_counter() - start
+
+    pixels = total.shape[0] * total.shape[1]
+    # The first sample of every shard is traced with the compilation and is not timed
+    timed_samples = (samples - args.workers) * pixels
+    render_time = float(infos[:, 3].max())
+    print(f"{samples} samples per pixel from {args.workers} shards written to {args.output}")
+    print(f"{wall_time:.2f}s wall time | slowest shard {render_time:.2f}s | {timed_samples / max(render_time, 1e-9):,.0f} samples/s without compilation")
+    return {'wall_time': wall_time, 'render_time': render_time, 'timed_samples': timed_samples}
+
+
+if __name__ == '__main__':
+    render(parse_args())
@@ -4,7 +4,6 @@ from models.sphere import Sphere
 from models.hit import HitInfo
 from models.scene import Scene
 from models.integrator import trace
-from constants import MAX_BOUNCE
 from math import exp
 
 
@@ -17,15 +16,14 @@ Samothrace : 12 | 100
 Dragon : 38 | 201
 """
 
-@ti.func
-def fragment(ray, u, v, res, scene):
-    _, nb_triangle_tests, nb_boxes_tested = trace(ray, scene)
-    y = nb_triangle_tests/35
-    z = nb_boxes_tested/600
+neutral_color = {"r":203/255, "g":239/255 , "b":255/255}
+power_color = {"r":255/255, "g":0/255 , "b":0/255}
 
-    neutral_color = {"r":203/255, "g":239/255 , "b":255/255}
-    power_color = {"r":255/255, "g":0/255 , "b":0/255}
+@ti.func
+def fragment(ray, u, v, res, scene, sampler):
+    _, nb_triangle_tests, nb_boxes_tested, _, _ = trace(ray, scene, sampler)
 
+    # Intersection tests of the path, 600 is full red
     x = (nb_triangle_tests+nb_boxes_tested)/600
 
     r = (power_color["r"]-neutral_color["r"])*x+neutral_color["r"]
@@ -7,7 +7,7 @@ from models.scene import Scene
 normalize = ti.math.normalize
 
 @ti.func
-def fragment(ray, u, v, res, scene):
+def fragment(ray, u, v, res, scene, sampler):
     hitInf = scene.hit(ray)
     result = Color([0., 0., 0.])
     if hitInf.didHit:
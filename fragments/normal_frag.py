@@ -9,7 +9,7 @@ normalize = ti.math.normalize
 
 
 @ti.func
-def fragment(ray, u, v, res, scene):
+def fragment(ray, u, v, res, scene, sampler):
     hitInf = scene.hit(ray, 0)[0]
     result = Color([0., 0., 0.])
     if hitInf.didHit:
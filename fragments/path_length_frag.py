@@ -0,0 +1,20 @@
+import taichi as ti
+from models.vector import Color
+from models.integrator import trace
+from constants import MAX_BOUNCE
+
+
+neutral_color = {"r":203/255, "g":239/255 , "b":255/255}
+power_color = {"r":255/255, "g":0/255 , "b":0/255}
+
+@ti.func
+def fragment(ray, u, v, res, scene, sampler):
+    _, _, _, _, nb_bounces = trace(ray, scene, sampler)
+
+    # Bounces of the path, without the shadow rays, MAX_BOUNCE is full red
+    x = nb_bounces/MAX_BOUNCE
+
+    r = (power_color["r"]-neutral_color["r"])*x+neutral_color["r"]
+    g = (power_color["g"]-neutral_color["g"])*x+neutral_color["g"]
+    b = (power_color["b"]-neutral_color["b"])*x+neutral_color["b"]
+    return Color(r, g, b)
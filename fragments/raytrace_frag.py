@@ -10,6 +10,6 @@ from models.integrator import trace
 normalize = ti.math.normalize
 
 @ti.func
-def fragment(ray, u, v, res, scene):
-    col, _, _ = trace(ray, scene)
+def fragment(ray, u, v, res, scene, sampler):
+    col, _, _, _, _ = trace(ray, scene, sampler)
     return col
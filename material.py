@@ -2,8 +2,8 @@ import taichi as ti
 from taichi.math import dot, normalize, sqrt, length
 from models.vector import Point, Vec3, Color
 from models.ray import Ray
-from utils.alea import randomHemisphereDirection
-from utils.alea import randomDirection
+from utils.sampler import cosineHemisphere, uniformHemisphere, uniformSphere
+from constants import PI, COSINE_SAMPLING
 
 
 class _material:
@@ -12,7 +12,7 @@ class _material:
         return Color(0., 0., 0.)
 
     @ti.func
-    def scatter(self, ray, hitRec):
+    def scatter(self, ray, hitRec, sampler: ti.template()):
         return Color(0., 0., 0.), Ray(), False
 
 # ID : 0
@@ -21,10 +21,38 @@ class Lambertian(_material):
     albedo: Vec3
 
     @ti.func
-    def scatter(self, ray, hitRec):
-        attenuation = self.albedo
-        scatter_dir = hitRec.normal/4 + randomHemisphereDirection(hitRec.normal)
-        return attenuation, Ray(hitRec.hitPoint, scatter_dir), True
+    def scatter(self, ray, hitRec, sampler: ti.template()):
+        # The attenuation is the estimator weight bsdf * cos / pdf, just the
+        # albedo when the direction follows the cosine lobe
+        scatter_dir = Vec3(0., 0., 0.)
+        if ti.static(COSINE_SAMPLING):
+            scatter_dir = cosineHemisphere(hitRec.normal, sampler.next2D())
+        else:
+            scatter_dir = uniformHemisphere(hitRec.normal, sampler.next2D())
+        attenuation = Color(0., 0., 0.)
+        bounce = False
+        pdf = self.pdf(hitRec, scatter_dir)
+        if pdf > 0.:
+            cos_theta = dot(hitRec.normal, scatter_dir)
+            attenuation = self.eval() * cos_theta / pdf
+            bounce = True
+        return attenuation, Ray(hitRec.hitPoint, scatter_dir), bounce
+
+    @ti.func
+    def eval(self):
+        return self.albedo / PI
+
+    @ti.func
+    def pdf(self, hitRec, direction):
+        # Solid angle pdf of scatter
+        cos_theta = dot(hitRec.normal, normalize(direction))
+        pdf = 0.
+        if cos_theta > 0.:
+            if ti.static(COSINE_SAMPLING):
+                pdf = cos_theta / PI
+            else:
+                pdf = 1. / (2. * PI)
+        return pdf
 
 
 @ti.func
@@ -38,9 +66,9 @@ class Metal(_material):
     fuzz: ti.f32
 
     @ti.func
-    def scatter(self, ray, hitRec):
+    def scatter(self, ray, hitRec, sampler: ti.template()):
         bounce = True
-        reflected = normalize(reflect(ray.direction, hitRec.normal)) + (self.fuzz*randomDirection())
+        reflected = normalize(reflect(ray.direction, hitRec.normal)) + (self.fuzz*uniformSphere(sampler.next2D()))
         attenuation = self.albedo
         scattered = Ray(hitRec.hitPoint, reflected)
         if dot(scattered.direction, hitRec.normal) < 0:
@@ -82,7 +110,7 @@ class Dielectric(_material):
     ir: ti.f32  # Index of Refraction
 
     @ti.func
-    def scatter(self, ray, hitRec):
+    def scatter(self, ray, hitRec, sampler: ti.template()):
         bounce = True
         attenuation = Color(1.0, 1.0, 1.0)  # Glass surface absorbs nothing
 
@@ -95,7 +123,7 @@ class Dielectric(_material):
         cannotRefract = refractionRatio * sinTheta > 1.0
         direction = Vec3(0.0, 0.0, 0.0)
 
-        if cannotRefract or reflectance(cosTheta, refractionRatio) > ti.random():
+        if cannotRefract or reflectance(cosTheta, refractionRatio) > sampler.next2D()[0]:
             direction = reflect(unitDirection, hitRec.normal)
         else:
             direction = refract(unitDirection, hitRec.normal, refractionRatio)
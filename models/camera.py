@@ -53,10 +53,11 @@ class Camera:
         self.pixel00_loc = self.view_port_bottom_left + 0.5*(self.pixel_delta_u + self.pixel_delta_v)
 
     @ti.func
-    def get_ray(self, i:int, j:int) -> Ray:
+    def get_ray(self, i:int, j:int, sampler: ti.template()) -> Ray:
         # Pour l'ant-aliasing
-        offset_x = (ti.random() - 0.5)
-        offset_y = (ti.random() - 0.5)
+        xi = sampler.next2D()
+        offset_x = (xi[0] - 0.5)
+        offset_y = (xi[1] - 0.5)
 
         pixel_center = self.pixel00_loc + ((i+offset_x) * self.pixel_delta_u) + ((j+offset_y) * self.pixel_delta_v)
         ray_direction = pixel_center - self.lookfrom
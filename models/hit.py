@@ -10,3 +10,4 @@ class HitInfo:
     normal: Vec3
     material_coord: MaterialCoord
     frontFace: bool
+    primitive: ti.types.vector(2, ti.i32)  # (type, index) of the primitive, see models.scene
@@ -3,22 +3,78 @@ from constants import *
 from material import Lambertian
 from models.hit import HitInfo
 from .vector import Vec3, Color
-from utils.alea import randomHemisphereDirection
+from models.ray import Ray
+from models.light import misWeight
 from environments.simple_sky import simpleSkyEnv
 from environments.hdri_env import hdr_background
+from utils.sampler import BSDF_DIMENSION, ROULETTE_DIMENSION
+from utils import stats
+
+# Rays traced since the last fold, read by the offline renderer. Taichi sums
+# the += of a parallel loop in a thread-local copy, so this costs one atomic
+# add per thread and launch, not one per path
+ray_counter = ti.field(ti.i32, shape=())
+
+@ti.func
+def directLight(scene, ray, hitInfos, mat, sampler: ti.template()):
+    """
+    Next event estimation at a Lambertian hit: light from a point sampled on
+    a light, weighted against BSDF sampling with MIS.
+    """
+    contribution = Color(0., 0., 0.)
+    triangle_count = 0
+    box_count = 0
+    point, light_pdf, emission = scene.sampleLight(hitInfos.hitPoint, sampler.next2D())
+    if light_pdf > 0.:
+        to_light = point - hitInfos.hitPoint
+        cos_theta = ti.math.dot(hitInfos.normal, to_light)
+        if cos_theta > 0.:
+            # The shadow ray reaches the light at t = 1
+            occluded, triangle_count, box_count = scene.occluded(Ray(hitInfos.hitPoint, to_light), 1. - SHADOW_EPS)
+            if not occluded:
+                bsdf_pdf = mat.pdf(hitInfos, to_light)
+                contribution = mat.eval() * emission * (cos_theta / to_light.norm()) * misWeight(light_pdf, bsdf_pdf) / light_pdf
+    return contribution, triangle_count, box_count
 
 @ti.func
-def trace(ray, scene):
+def russianRoulette(throughput, k, sampler: ti.template()):
+    # A path survives with a probability that follows its throughput,
+    # survivors are reweighted so the estimate stays unbiased
+    survive = True
+    if k + 1 >= RR_START_DEPTH:
+        survival = ti.min(throughput.max(), RR_MAX_SURVIVAL)
+        sampler.startBounce(k, ROULETTE_DIMENSION)
+        if sampler.next1D() >= survival:
+            survive = False
+        else:
+            throughput /= survival
+    return throughput, survive
+
+@ti.func
+def trace(ray, scene, sampler: ti.template()):
+    """
+    Radiance of one path, with its triangle and box tests, its rays (shadow
+    rays included) and its length (the bounce rays only).
+    """
     current_attenuation = Color(1., 1., 1.)
     accumulated_emission = Color(0., 0., 0.)
     nb_triangles_tested = 0
     nb_boxes_tested = 0
+    nb_rays = 0
+    path_length = 0
+    # Pdf of the last bounce, 0 for camera rays and specular bounces whose
+    # emission hits are not weighted against light sampling
+    bsdf_pdf = 0.
 
     for k in range(MAX_BOUNCE):
+        sampler.startBounce(k)
         hitInfos, tc, bc = scene.hit(ray, k)
+        nb_rays += 1
+        path_length += 1
         nb_triangles_tested += tc
         nb_boxes_tested += bc
         if hitInfos.didHit and hitInfos.dst >= 0.0 :
+            origin = ray.origin
             ray.origin = hitInfos.hitPoint
             mat_id, mat_num = hitInfos.material_coord
             attenuation = Color(1., 1., 1.)
@@ -26,33 +82,54 @@ def trace(ray, scene):
             if mat_id == 0: # Lambertian
                 mat = scene.lambertian_materials[mat_num]
                 accumulated_emission += current_attenuation*mat.emmited()
-                attenuation, ray, bounce = mat.scatter(ray, hitInfos)
+                if ti.static(NEXT_EVENT_ESTIMATION):
+                    direct, tc, bc = directLight(scene, ray, hitInfos, mat, sampler)
+                    accumulated_emission += current_attenuation*direct
+                    nb_rays += 1
+                    nb_triangles_tested += tc
+                    nb_boxes_tested += bc
+                sampler.startBounce(k, BSDF_DIMENSION)
+                attenuation, ray, bounce = mat.scatter(ray, hitInfos, sampler)
+                bsdf_pdf = mat.pdf(hitInfos, ray.direction)
                 if not bounce:
                     break
             if mat_id == 1: # Metal
                 mat = scene.metal_materials[mat_num]
                 accumulated_emission += current_attenuation*mat.emmited()
-                attenuation, ray, bounce = mat.scatter(ray, hitInfos)
+                sampler.startBounce(k, BSDF_DIMENSION)
+                attenuation, ray, bounce = mat.scatter(ray, hitInfos, sampler)
+                bsdf_pdf = 0.
                 if not bounce:
                     break
             if mat_id == 2: # DiffuseLight
                 mat = scene.diffuseLight_materials[mat_num]
-                accumulated_emission += current_attenuation*mat.emmited()
-                attenuation, ray, bounce = mat.scatter(ray, hitInfos)
+                weight = 1.
+                if ti.static(NEXT_EVENT_ESTIMATION):
+                    # Lights reached by a diffuse bounce were also sampled by directLight
+                    if bsdf_pdf > 0.:
+                        weight = misWeight(bsdf_pdf, scene.lightPdf(origin, hitInfos))
+                accumulated_emission += current_attenuation*mat.emmited()*weight
+                attenuation, ray, bounce = mat.scatter(ray, hitInfos, sampler)
                 if not bounce:
                     break
 
             if mat_id == 3: # DiffuseLight
                 mat = scene.dielectric_materials[mat_num]
                 accumulated_emission += current_attenuation*mat.emmited()
-                attenuation, ray, bounce = mat.scatter(ray, hitInfos)
+                sampler.startBounce(k, BSDF_DIMENSION)
+                attenuation, ray, bounce = mat.scatter(ray, hitInfos, sampler)
+                bsdf_pdf = 0.
                 if not bounce:
                     break
 
-            current_attenuation *= attenuation
+            current_attenuation, survive = russianRoulette(current_attenuation*attenuation, k, sampler)
+            if not survive:
+                break
         else:
             temp = Color(0., 0., 0.)
             #temp += simpleSkyEnv(ray)
             accumulated_emission += current_attenuation * temp
             break
-    return accumulated_emission, nb_triangles_tested, nb_boxes_tested
+    ray_counter[None] += nb_rays
+    stats.record(sampler.x, sampler.y, 1, nb_rays, nb_boxes_tested, nb_triangles_tested, path_length)
+    return accumulated_emission, nb_triangles_tested, nb_boxes_tested, nb_rays, path_length
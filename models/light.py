@@ -0,0 +1,82 @@
+import taichi as ti
+from models.vector import Vec3, Point
+from constants import *
+from utils.sampler import orthonormalBasis
+
+dot = ti.math.dot
+normalize = ti.math.normalize
+cross = ti.math.cross
+
+
+@ti.func
+def sampleQuad(quad, origin, xi):
+    """
+    Uniform point on a quad light, seen from origin, from the uniforms xi.
+
+    Returns the point and the solid angle pdf of its direction, 0 when the
+    quad is seen edge-on.
+    """
+    point = quad.q + xi[0] * quad.u + xi[1] * quad.v
+    return point, quadPdf(quad, origin, point)
+
+
+@ti.func
+def quadPdf(quad, origin, point):
+    # Area pdf 1/A turned into a solid angle pdf d^2 / (cos * A)
+    to_light = point - origin
+    dst2 = dot(to_light, to_light)
+    cos_light = ti.abs(dot(quad.normal, to_light)) / ti.sqrt(dst2)
+    pdf = 0.
+    if cos_light > EPS:
+        pdf = dst2 / (cos_light * quad.area)
+    return pdf
+
+
+@ti.func
+def sampleSphere(sphere, origin, xi):
+    """
+    Point of a sphere light sampled uniformly in the cone it subtends from
+    origin, from the uniforms xi.
+
+    Returns the point and the solid angle pdf of its direction, 0 when origin
+    is inside the sphere.
+    """
+    to_center = sphere.center - origin
+    dst2 = dot(to_center, to_center)
+    point = sphere.center
+    pdf = 0.
+    if dst2 > sphere.radius2:
+        dst = ti.sqrt(dst2)
+        w = to_center / dst
+        u, v = orthonormalBasis(w)
+        cos_theta_max = ti.sqrt(1. - sphere.radius2 / dst2)
+        cos_theta = 1. - xi[0] * (1. - cos_theta_max)
+        sin_theta = ti.sqrt(ti.max(0., 1. - cos_theta * cos_theta))
+        phi = 2. * PI * xi[1]
+        direction = cos_theta * w + sin_theta * (ti.cos(phi) * u + ti.sin(phi) * v)
+        # Nearest intersection of the sampled direction with the sphere
+        b = dot(direction, to_center)
+        t = b - ti.sqrt(ti.max(0., b * b - dst2 + sphere.radius2))
+        point = origin + t * direction
+        pdf = 1. / (2. * PI * (1. - cos_theta_max))
+    return point, pdf
+
+
+@ti.func
+def spherePdf(sphere, origin):
+    to_center = sphere.center - origin
+    dst2 = dot(to_center, to_center)
+    pdf = 0.
+    if dst2 > sphere.radius2:
+        cos_theta_max = ti.sqrt(1. - sphere.radius2 / dst2)
+        pdf = 1. / (2. * PI * (1. - cos_theta_max))
+    return pdf
+
+
+@ti.func
+def misWeight(pdf, other_pdf):
+    # Balance heuristic
+    weight = 0.
+    if pdf > 0.:
+        weight = pdf / (pdf + other_pdf)
+    return weight
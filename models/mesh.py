@@ -3,6 +3,9 @@ from models.vector import MaterialCoord, Vec3, Point
 from models.hit import HitInfo
 from constants import *
 from models.ray import Ray
+from models.triangle import hitTriangle, occludedTriangle
+from utils.make_matrix import make_transform_mat, make_world_mat, make_normal_mat
+from utils.stats import recordStackDepth
 
 
 @ti.dataclass
@@ -30,36 +33,22 @@ class BoundingBox:
     #     self.growToIncludePoint(triangle.v2)
 
     @ti.func
-    def hit(self, ray):
+    def hitSlab(self, origin, inv_direction):
         """
-        Check if the ray intersects with the bounding box.
-        Returns True if there's an intersection, False otherwise.
+        Slab test with a precomputed inverse direction (see safeInverse).
+        Returns the entry distance, or MAX_LEN if the box is missed or behind.
         """
-        t_min = float('-inf')
-        t_max = float('inf')
-        res = True
-
-        for i in range(3):
-            # Handle case where ray direction component is close to 0
-            if ti.abs(ray.direction[i]) < EPS:
-                if ray.origin[i] < self.min[i] or ray.origin[i] > self.max[i]:
-                    res = False
-            else:
-                # Calculate intersection distances
-                t1 = (self.min[i] - ray.origin[i]) / ray.direction[i]
-                t2 = (self.max[i] - ray.origin[i]) / ray.direction[i]
-
-                # Ensure t1 is the smaller value
-                if t1 > t2:
-                    t1, t2 = t2, t1
-
-                t_min = ti.max(t_min, t1)
-                t_max = ti.min(t_max, t2)
-
-                if t_min > t_max:
-                    res = False
-
-        return ti.select(res, t_min, MAX_LEN)
+        t1 = (self.min - origin) * inv_direction
+        t2 = (self.max - origin) * inv_direction
+        t_near = ti.max(ti.min(t1, t2).max(), 0.)
+        t_far = ti.max(t1, t2).min()
+        return ti.select(t_near <= t_far, t_near, MAX_LEN)
+
+@ti.func
+def safeInverse(direction):
+    # 1/direction without infinities, keeping the sign of each component
+    safe_direction = ti.select(direction >= 0, ti.max(direction, EPS*EPS), ti.min(direction, -EPS*EPS))
+    return 1.0 / safe_direction
 
 @ti.dataclass
 class BVHNode:
@@ -67,6 +56,23 @@ class BVHNode:
     childIndex: ti.i32
     triangleIndex: ti.i32
     triangleCount: ti.i32
+    escapeIndex: ti.i32
+
+WideVec = ti.types.vector(BVH_WIDTH, ti.f32)
+WideIndex = ti.types.vector(BVH_WIDTH, ti.i32)
+
+@ti.dataclass
+class WideBVHNode:
+    # Bounds of the BVH_WIDTH children, one vector per coordinate (SoA)
+    minx: WideVec
+    miny: WideVec
+    minz: WideVec
+    maxx: WideVec
+    maxy: WideVec
+    maxz: WideVec
+    # Leaf : triangleCount > 0, internal : triangleCount == 0, empty : -1
+    childIndex: WideIndex
+    triangleCount: WideIndex
 
 @ti.dataclass
 class Mesh:
@@ -74,19 +80,25 @@ class Mesh:
     meshLen: ti.i32
     material_coord: MaterialCoord
     worldToLocal: ti.types.matrix(4, 4, ti.f32)  # 4x4
+    localToWorld: ti.types.matrix(4, 4, ti.f32)
+    normalMatrix: ti.types.matrix(3, 3, ti.f32)  # transpose of worldToLocal's 3x3 part
 
     @ti.func
     def hit(self, ray, triangle_buffer, bvhNodes_buffer):
         localRay = self.transformRay(ray)
+        inv_direction = safeInverse(localRay.direction)
         closest_hit = HitInfo(didHit=False, dst=MAX_LEN)
         stack = ti.Vector([0] * 50)
         stack_ptr = 0
+        deepest = 0
         current_node = 0
 
         triangle_test_count = 0
         box_test_count = 0
 
         while stack_ptr >= 0:
+            if ti.static(STATS):
+                deepest = ti.max(deepest, stack_ptr + 1)
             current_node = stack[stack_ptr]
             stack_ptr -= 1
             box_test_count += 1
@@ -94,8 +106,7 @@ class Mesh:
             node = bvhNodes_buffer[current_node]
             if node.childIndex == 0:  # Leaf node
                 for i in range(node.triangleIndex, node.triangleIndex + node.triangleCount):
-                    triangle = triangle_buffer[i]
-                    intersect = triangle.hit(localRay)
+                    intersect = hitTriangle(triangle_buffer, i, localRay)
                     triangle_test_count += 1
                     if intersect.didHit and intersect.dst < closest_hit.dst:
                         closest_hit = intersect
@@ -103,8 +114,8 @@ class Mesh:
                 leftChild = node.childIndex
                 rightChild = node.childIndex + 1
 
-                dstLeft = bvhNodes_buffer[leftChild].boundingBox.hit(localRay)
-                dstRight = bvhNodes_buffer[rightChild].boundingBox.hit(localRay)
+                dstLeft = bvhNodes_buffer[leftChild].boundingBox.hitSlab(localRay.origin, inv_direction)
+                dstRight = bvhNodes_buffer[rightChild].boundingBox.hitSlab(localRay.origin, inv_direction)
 
                 # Push children to stack in far-to-near order
                 if dstLeft < dstRight:
@@ -124,12 +135,147 @@ class Mesh:
 
         if closest_hit.didHit:
             closest_hit = self.transformHitInfo(closest_hit, ray)
+        recordStackDepth(deepest)
         return closest_hit, triangle_test_count, box_test_count
 
 
+    @ti.func
+    def occluded(self, ray, t_max, triangle_buffer, bvhNodes_buffer):
+        # Any hit before the ray parameter t_max, which is the same in local
+        # space. No hit record, no child ordering, stops at the first triangle
+        localRay = self.transformRay(ray)
+        inv_direction = safeInverse(localRay.direction)
+        stack = ti.Vector([0] * 50)
+        stack_ptr = 0
+        deepest = 0
+        found = False
+
+        triangle_test_count = 0
+        box_test_count = 0
+
+        while stack_ptr >= 0 and not found:
+            if ti.static(STATS):
+                deepest = ti.max(deepest, stack_ptr + 1)
+            node = bvhNodes_buffer[stack[stack_ptr]]
+            stack_ptr -= 1
+            box_test_count += 1
+
+            if node.childIndex == 0:  # Leaf node
+                for i in range(node.triangleIndex, node.triangleIndex + node.triangleCount):
+                    triangle_test_count += 1
+                    if occludedTriangle(triangle_buffer, i, localRay, t_max):
+                        found = True
+                        break
+            else:  # Internal node
+                for child in ti.static(range(2)):
+                    if bvhNodes_buffer[node.childIndex + child].boundingBox.hitSlab(localRay.origin, inv_direction) < t_max:
+                        stack_ptr += 1
+                        stack[stack_ptr] = node.childIndex + child
+
+        recordStackDepth(deepest)
+        return found, triangle_test_count, box_test_count
+
+    @ti.func
+    def hitStackless(self, ray, triangle_buffer, bvhNodes_buffer):
+        # Follows the escape links of bvh.sah_builder.thread_bvh : no stack,
+        # but children are always visited in the same order
+        localRay = self.transformRay(ray)
+        inv_direction = safeInverse(localRay.direction)
+        closest_hit = HitInfo(didHit=False, dst=MAX_LEN)
+        current_node = 0
+
+        triangle_test_count = 0
+        box_test_count = 0
+
+        while current_node != -1:
+            node = bvhNodes_buffer[current_node]
+            box_test_count += 1
+            if node.boundingBox.hitSlab(localRay.origin, inv_direction) < closest_hit.dst:
+                if node.childIndex == 0:  # Leaf node
+                    for i in range(node.triangleIndex, node.triangleIndex + node.triangleCount):
+                        intersect = hitTriangle(triangle_buffer, i, localRay)
+                        triangle_test_count += 1
+                        if intersect.didHit and intersect.dst < closest_hit.dst:
+                            closest_hit = intersect
+                    current_node = node.escapeIndex
+                else:  # Internal node
+                    current_node = node.childIndex
+            else:
+                current_node = node.escapeIndex
+
+        if closest_hit.didHit:
+            closest_hit = self.transformHitInfo(closest_hit, ray)
+        return closest_hit, triangle_test_count, box_test_count
+
+    @ti.func
+    def hitWide(self, ray, triangle_buffer, wideNodes_buffer):
+        # Traversal of the BVH4/BVH8 of bvh.wide_bvh.collapse_bvh : one node
+        # fetch tests the boxes of all its children with vector slab tests
+        localRay = self.transformRay(ray)
+        closest_hit = HitInfo(didHit=False, dst=MAX_LEN)
+        stack = ti.Vector([0] * MAX_STACK_SIZE)
+        stack_ptr = 0
+        deepest = 0
+
+        triangle_test_count = 0
+        box_test_count = 0
+
+        origin = localRay.origin
+        direction = localRay.direction
+        inv_direction = safeInverse(direction)
+
+        while stack_ptr >= 0:
+            if ti.static(STATS):
+                deepest = ti.max(deepest, stack_ptr + 1)
+            node = wideNodes_buffer[stack[stack_ptr]]
+            stack_ptr -= 1
+            box_test_count += 1
+
+            tx1 = (node.minx - origin.x) * inv_direction.x
+            tx2 = (node.maxx - origin.x) * inv_direction.x
+            ty1 = (node.miny - origin.y) * inv_direction.y
+            ty2 = (node.maxy - origin.y) * inv_direction.y
+            tz1 = (node.minz - origin.z) * inv_direction.z
+            tz2 = (node.maxz - origin.z) * inv_direction.z
+            t_near = ti.max(ti.max(ti.min(tx1, tx2), ti.min(ty1, ty2)), ti.min(tz1, tz2))
+            t_far = ti.min(ti.min(ti.max(tx1, tx2), ti.max(ty1, ty2)), ti.max(tz1, tz2))
+
+            # Leaves are tested right away, internal children are sorted below
+            push_dst = WideVec([MAX_LEN] * BVH_WIDTH)
+            for k in ti.static(range(BVH_WIDTH)):
+                count = node.triangleCount[k]
+                if count >= 0 and t_near[k] <= t_far[k] and t_far[k] >= 0 and t_near[k] < closest_hit.dst:
+                    if count > 0:  # Leaf
+                        for i in range(node.childIndex[k], node.childIndex[k] + count):
+                            intersect = hitTriangle(triangle_buffer, i, localRay)
+                            triangle_test_count += 1
+                            if intersect.didHit and intersect.dst < closest_hit.dst:
+                                closest_hit = intersect
+                    else:
+                        push_dst[k] = t_near[k]
+
+            # Push internal children in far-to-near order
+            for _ in ti.static(range(BVH_WIDTH)):
+                farthest = -1
+                farthest_dst = -MAX_LEN
+                for k in ti.static(range(BVH_WIDTH)):
+                    if push_dst[k] < closest_hit.dst and push_dst[k] > farthest_dst:
+                        farthest = k
+                        farthest_dst = push_dst[k]
+                if farthest >= 0:
+                    stack_ptr += 1
+                    stack[stack_ptr] = node.childIndex[farthest]
+                    push_dst[farthest] = MAX_LEN
+
+        if closest_hit.didHit:
+            closest_hit = self.transformHitInfo(closest_hit, ray)
+        recordStackDepth(deepest)
+        return closest_hit, triangle_test_count, box_test_count
+
     @ti.func
     def transformRay(self, ray):
-        # Transform ray origin and direction to local space
+        # Transform ray origin and direction to local space. The direction is
+        # not normalized, so a local ray parameter t is also the world one
         origin = ti.Vector([ray.origin[0], ray.origin[1], ray.origin[2], 1.0])
         direction = ti.Vector([ray.direction[0], ray.direction[1], ray.direction[2], 0.0])
 
@@ -138,29 +284,26 @@ class Mesh:
 
         return Ray(
             origin=ti.Vector([local_origin[0], local_origin[1], local_origin[2]]),
-            direction=ti.Vector([local_direction[0], local_direction[1], local_direction[2]]).normalized()
+            direction=ti.Vector([local_direction[0], local_direction[1], local_direction[2]])
         )
 
     @ti.func
     def transformHitInfo(self, hit, ray):
-        # Transform hit point
-        point = ti.Vector([hit.hitPoint.x, hit.hitPoint.y, hit.hitPoint.z, 1.0])
-        world_point = (self.worldToLocal.inverse() @ point).xyz
-
-        # Transform normal (using transpose of inverse matrix)
-        normal = ti.Vector([hit.normal.x, hit.normal.y, hit.normal.z, 0.0])
-        world_normal = (self.worldToLocal.transpose() @ normal).xyz.normalized()
-
-        # Update hit point and normal in world space
-        hit.hitPoint = Point(world_point[0], world_point[1], world_point[2])
-        hit.normal = Vec3(world_normal[0], world_normal[1], world_normal[2])
-
-        # Correctly update distance from ray origin to the world-space hit point
-        ray_origin_world = Vec3([ray.origin.x, ray.origin.y, ray.origin.z])
-        hit.dst = (world_point - ray_origin_world).norm()
-
+        # hit.dst is the ray parameter, shared by the local and the world ray
+        t = hit.dst
+        hit.hitPoint = ray.at(t)
+        hit.normal = (self.normalMatrix @ hit.normal).normalized()
+        hit.dst = t * ray.direction.norm()
         return hit
 
+def create_mesh(beginIndex, meshLen, material_coord, translation, rotation, scale):
+    # Every matrix of the mesh is computed once, here, instead of per hit
+    worldToLocal = make_transform_mat(translation, rotation, scale)
+    localToWorld = make_world_mat(translation, rotation, scale)
+    normalMatrix = make_normal_mat(worldToLocal)
+    return Mesh(beginIndex=beginIndex, meshLen=meshLen, material_coord=material_coord,
+                worldToLocal=worldToLocal, localToWorld=localToWorld, normalMatrix=normalMatrix)
+
 def createBoundingBox():
     return BoundingBox(min=Vec3(1.)*float('-inf'), max=Vec3(1.)*float('inf'))
 
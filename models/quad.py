@@ -21,17 +21,31 @@ def dot_ker(u:Vec3, v:Vec3) -> ti.f32:
 def cross_ker(u:Vec3, v:Vec3) -> Vec3:
     return cross(u, v)
 
+@ti.func
+def quadConstants(u, v):
+    """
+    Per quad constants of Quad.hit: the point q + alpha*u + beta*v of the
+    plane has alpha = dot(p - q, uAxis) and beta = dot(p - q, vAxis).
+
+    Returns:
+        tuple: (uAxis, vAxis, area)
+    """
+    n = cross(u, v)
+    area2 = dot(n, n)
+    return cross(v, n) / area2, cross(n, u) / area2, ti.sqrt(area2)
+
 @ti.dataclass
 class Quad:
     q: Point
     u: Vec3
     v: Vec3
     normal: Vec3
-    w: Vec3
     d: ti.f32
     material_coord: MaterialCoord
-
-
+    # Filled by Scene.precomputePrimitives, see quadConstants
+    uAxis: Vec3
+    vAxis: Vec3
+    area: ti.f32
 
     @ti.func
     def is_interior(self, a, b):
@@ -39,37 +53,34 @@ class Quad:
 
     @ti.func
     def hit(self, ray:Ray) -> HitInfo:
+        # The distance is computed for every ray, parallel ones divide by 1
+        # instead of 0, and one branch tests the hit
         hitInf = HitInfo(didHit=False)
-        normal = self.normal
-        d = self.d
-        denom = dot(normal, ray.direction)
-
-        if abs(denom) > EPS:
-            dst = (d - dot(normal, ray.origin)) / denom
-
-            if dst > EPS:
-                intersection = ray.at(dst)
-                planar_hitpt_vector = intersection - self.q
-
-                # Cross product of u and v gives the area of the parallelogram
-                area_uv = dot(self.w, cross(self.u, self.v))
-
-                # Calculate alpha and beta
-                alpha = dot(self.w, cross(planar_hitpt_vector, self.v)) / area_uv
-                beta = dot(self.w, cross(self.u, planar_hitpt_vector)) / area_uv
-
-                good_direction_normal = -ti.math.sign(dot(normal, ray.direction))*normal
-                # Check if the hit point lies within the quad
-                if self.is_interior(alpha, beta):
-                    hitInf.didHit = True
-                    hitInf.hitPoint = intersection
-                    hitInf.dst = (ray.origin - intersection).norm()
-                    hitInf.normal = good_direction_normal
-                    hitInf.material_coord = self.material_coord
+        denom = dot(self.normal, ray.direction)
+        dst = (self.d - dot(self.normal, ray.origin)) / ti.select(abs(denom) > EPS, denom, 1.)
+        intersection = ray.at(dst)
+        planar_hitpt_vector = intersection - self.q
+        alpha = dot(planar_hitpt_vector, self.uAxis)
+        beta = dot(planar_hitpt_vector, self.vAxis)
+        if abs(denom) > EPS and dst > EPS and self.is_interior(alpha, beta):
+            hitInf.didHit = True
+            hitInf.hitPoint = intersection
+            hitInf.dst = (ray.origin - intersection).norm()
+            hitInf.normal = -ti.math.sign(denom)*self.normal
+            hitInf.material_coord = self.material_coord
         return hitInf
 
+    @ti.func
+    def occluded(self, ray:Ray, t_max):
+        # Any hit before the ray parameter t_max, without hit record
+        denom = dot(self.normal, ray.direction)
+        dst = (self.d - dot(self.normal, ray.origin)) / ti.select(abs(denom) > EPS, denom, 1.)
+        planar_hitpt_vector = ray.at(dst) - self.q
+        alpha = dot(planar_hitpt_vector, self.uAxis)
+        beta = dot(planar_hitpt_vector, self.vAxis)
+        return abs(denom) > EPS and dst > EPS and dst < t_max and self.is_interior(alpha, beta)
+
 def create_quad(q, u, v, material_coord):
     normal = normalize_ker(cross_ker(u, v))
     d = dot_ker(normal, q)
-    w = normal / dot_ker(normal, normal)
-    return Quad(q=q, u=u, v=v, normal=normal, d=d, w=w, material_coord=material_coord)
+    return Quad(q=q, u=u, v=v, normal=normal, d=d, material_coord=material_coord)
@@ -3,13 +3,25 @@ import taichi as ti
 from taichi.lang.struct import dataclass
 from models.hit import HitInfo
 from models.sphere import Sphere
-from models.quad import Quad
+from models.quad import Quad, quadConstants
 from models.triangle import Triangle
-from models.mesh import BVHNode, Mesh
-from models.vector import Vec3, Point, Color
+from models.mesh import BVHNode, Mesh, safeInverse
+from models.light import sampleQuad, quadPdf, sampleSphere, spherePdf
+from models.vector import Vec3, Point, Color, MaterialCoord
 from material import DiffuseLight, Lambertian, Metal, Dielectric
 from constants import *
+import numpy as np
+import time
+from bvh.sah_builder import build_bvh_from_bounds
+from utils.stats import recordStackDepth
 
+# Primitive types of the top-level BVH
+SPHERE_PRIMITIVE = 0
+QUAD_PRIMITIVE = 1
+MESH_PRIMITIVE = 2
+
+# Material id of DiffuseLight in material_coord
+DIFFUSE_LIGHT_MATERIAL = 2
 
 
 hdr_image = Color.field(shape=3)
@@ -21,7 +33,7 @@ emptyBVHNodeBuffer = BVHNode.field(shape=1)
 
 @ti.data_oriented
 class Scene:
-    def __init__(self, sphere_buffer=emptySphereBuffer, quad_buffer=emptyQuadBuffer, triangle_buffer=emptyTriangleBuffer, bvhNode_buffer=emptyBVHNodeBuffer, mesh_buffer=emptyMeshBuffer, lamb_materials=[], metal_materials=[], diffuseLight_materials=[], dielectric_materials=[], hdr_image=hdr_image) -> None:
+    def __init__(self, sphere_buffer=emptySphereBuffer, quad_buffer=emptyQuadBuffer, triangle_buffer=emptyTriangleBuffer, bvhNode_buffer=emptyBVHNodeBuffer, mesh_buffer=emptyMeshBuffer, lamb_materials=[], metal_materials=[], diffuseLight_materials=[], dielectric_materials=[], hdr_image=hdr_image, stackless_bvh=False, wideBVHNode_buffer=None) -> None:
         self.lamb_materials_number = len(lamb_materials)
         self.lambertian_materials = Lambertian.field(shape=self.lamb_materials_number+1)
         for i in range(self.lamb_materials_number):
@@ -59,33 +71,284 @@ class Scene:
 
         self.hdr_image = hdr_image
 
+        # Mesh traversal mode, fixed at compile time
+        self.stackless_bvh = stackless_bvh
+        self.wide_bvh = wideBVHNode_buffer is not None
+        self.wideBVHNode_buffer = wideBVHNode_buffer
+
+        self.precomputePrimitives()
+        self.buildTLAS()
+        self.buildLights()
+
+    @ti.kernel
+    def precomputePrimitives(self):
+        # Per primitive constants of the intersection tests, the empty last slots are skipped.
+        # They are stored in the AoS records: SoA fields were no faster on cpu, gpu was not measured
+        for i in range(self.sphere_number - 1):
+            radius = self.sphere_buffer[i].radius
+            self.sphere_buffer[i].radius2 = radius * radius
+            self.sphere_buffer[i].invRadius = 1. / radius
+        for i in range(self.quad_number - 1):
+            uAxis, vAxis, area = quadConstants(self.quad_buffer[i].u, self.quad_buffer[i].v)
+            self.quad_buffer[i].uAxis = uAxis
+            self.quad_buffer[i].vAxis = vAxis
+            self.quad_buffer[i].area = area
+
+    def buildLights(self):
+        """
+        List of the spheres and quads with a DiffuseLight material, sampled by next event estimation.
+        Emissive triangles are not in the list, they are only found by BSDF sampling.
+        """
+        lights = []
+        spheres = self.sphere_buffer.to_numpy()
+        for index in range(self.sphere_number-1):
+            if spheres['material_coord'][index][0] == DIFFUSE_LIGHT_MATERIAL:
+                lights.append((SPHERE_PRIMITIVE, index))
+        quads = self.quad_buffer.to_numpy()
+        for index in range(self.quad_number-1):
+            if quads['material_coord'][index][0] == DIFFUSE_LIGHT_MATERIAL:
+                lights.append((QUAD_PRIMITIVE, index))
+
+        self.light_number = len(lights)
+        self.lights = ti.types.vector(2, ti.i32).field(shape=max(self.light_number, 1))
+        if self.light_number > 0:
+            self.lights.from_numpy(np.array(lights, dtype=np.int32))
+
+    def primitiveBounds(self):
+        """
+        World-space AABB of every sphere, quad and mesh instance.
+        The last entry of each buffer is the empty slot added by utils.create_buffers.
+        """
+        mins, maxs, primitives = [], [], []
+
+        spheres = self.sphere_buffer.to_numpy()
+        for index in range(self.sphere_number-1):
+            center, radius = spheres['center'][index], spheres['radius'][index]
+            mins.append(center - radius)
+            maxs.append(center + radius)
+            primitives.append((SPHERE_PRIMITIVE, index))
+
+        quads = self.quad_buffer.to_numpy()
+        for index in range(self.quad_number-1):
+            q, u, v = quads['q'][index], quads['u'][index], quads['v'][index]
+            corners = np.array([q, q+u, q+v, q+u+v])
+            mins.append(corners.min(axis=0) - EPS)
+            maxs.append(corners.max(axis=0) + EPS)
+            primitives.append((QUAD_PRIMITIVE, index))
+
+        if self.mesh_number > 1:
+            # Every instance references the BLAS rooted at node 0
+            root = self.bvhNode_buffer[0].boundingBox
+            local_min, local_max = np.array(root.min), np.array(root.max)
+            corners = np.array([[x, y, z, 1.] for x in (local_min[0], local_max[0]) for y in (local_min[1], local_max[1]) for z in (local_min[2], local_max[2])])
+            meshes = self.mesh_buffer.to_numpy()
+            for index in range(self.mesh_number-1):
+                world_corners = (corners @ meshes['localToWorld'][index].T)[:, :3]
+                mins.append(world_corners.min(axis=0))
+                maxs.append(world_corners.max(axis=0))
+                primitives.append((MESH_PRIMITIVE, index))
+
+        mins = np.array(mins, dtype=np.float32).reshape(-1, 3)
+        maxs = np.array(maxs, dtype=np.float32).reshape(-1, 3)
+        primitives = np.array(primitives, dtype=np.int32).reshape(-1, 2)
+        return mins, maxs, primitives
+
+    def buildTLAS(self):
+        """
+        Top-level BVH over the world bounds of spheres, quads and mesh instances.
+        Each mesh keeps its own BVH (the BLAS), traversed from the TLAS leaves.
+        """
+        mins, maxs, primitives = self.primitiveBounds()
+        start = time.perf_counter()
+        nodes, order = build_bvh_from_bounds(mins, maxs, (mins + maxs) * 0.5)
+        # Read by the benchmarks
+        self.tlas_build_time = time.perf_counter() - start
+        primitives = primitives[order]
+
+        self.tlas_node_number = nodes['childIndex'].shape[0]
+        self.tlas_nodes = BVHNode.field(shape=self.tlas_node_number)
+        self.tlas_nodes.from_numpy(dict(nodes, escapeIndex=np.full(self.tlas_node_number, -1, dtype=np.int32)))
+
+        self.tlas_primitive_number = primitives.shape[0]
+        self.tlas_primitives = ti.types.vector(2, ti.i32).field(shape=max(self.tlas_primitive_number, 1))
+        if self.tlas_primitive_number > 0:
+            self.tlas_primitives.from_numpy(primitives)
+
     @ti.func
-    def hit(self, ray, k):
+    def hitMesh(self, index, ray):
         closest_hit = HitInfo(didHit=False, dst=MAX_LEN)
         triangle_count = 0
         box_count = 0
-        # Spheres
-        for index in range(self.sphere_number):
+        if ti.static(self.wide_bvh):
+            closest_hit, triangle_count, box_count = self.mesh_buffer[index].hitWide(ray, self.triangle_buffer, self.wideBVHNode_buffer)
+        elif ti.static(self.stackless_bvh):
+            closest_hit, triangle_count, box_count = self.mesh_buffer[index].hitStackless(ray, self.triangle_buffer, self.bvhNode_buffer)
+        else:
+            closest_hit, triangle_count, box_count = self.mesh_buffer[index].hit(ray, self.triangle_buffer, self.bvhNode_buffer)
+        return closest_hit, triangle_count, box_count
+
+    @ti.func
+    def hitPrimitive(self, primitive, ray, k):
+        primitive_type, index = primitive[0], primitive[1]
+        intersect = HitInfo(didHit=False, dst=MAX_LEN)
+        triangle_count = 0
+        box_count = 0
+        if primitive_type == SPHERE_PRIMITIVE:
             intersect = self.sphere_buffer[index].hit(ray)
-            if intersect.dst < closest_hit.dst and intersect.didHit:
-                closest_hit = intersect
+        elif primitive_type == QUAD_PRIMITIVE:
+            # The last quad is skipped by primary rays
+            if k != 0 or index != self.quad_number-2:
+                intersect = self.quad_buffer[index].hit(ray)
+        else:
+            intersect, triangle_count, box_count = self.hitMesh(index, ray)
+            intersect.material_coord = self.mesh_buffer[index].material_coord
+        intersect.primitive = primitive
+        return intersect, triangle_count, box_count
+
+    @ti.func
+    def occludedPrimitive(self, primitive, ray, t_max):
+        primitive_type, index = primitive[0], primitive[1]
+        res = False
+        triangle_count = 0
+        box_count = 0
+        if primitive_type == SPHERE_PRIMITIVE:
+            res = self.sphere_buffer[index].occluded(ray, t_max)
+        elif primitive_type == QUAD_PRIMITIVE:
+            res = self.quad_buffer[index].occluded(ray, t_max)
+        else:
+            # The binary BVH is built in every traversal mode
+            res, triangle_count, box_count = self.mesh_buffer[index].occluded(ray, t_max, self.triangle_buffer, self.bvhNode_buffer)
+        return res, triangle_count, box_count
+
+    @ti.func
+    def occluded(self, ray, t_max):
+        """
+        Any-hit query for shadow rays: is there anything along the ray before
+        the ray parameter t_max ? Stops at the first hit found.
+        """
+        found = False
+        triangle_count = 0
+        box_count = 0
+
+        inv_direction = safeInverse(ray.direction)
+        stack = ti.Vector([0] * 50)
+        stack_ptr = 0
+        deepest = 0
+
+        while stack_ptr >= 0 and not found:
+            if ti.static(STATS):
+                deepest = ti.max(deepest, stack_ptr + 1)
+            node = self.tlas_nodes[stack[stack_ptr]]
+            stack_ptr -= 1
+            box_count += 1
+
+            if node.childIndex == 0:  # Leaf node
+                for i in range(node.triangleIndex, node.triangleIndex + node.triangleCount):
+                    res, tc, bc = self.occludedPrimitive(self.tlas_primitives[i], ray, t_max)
+                    triangle_count += tc
+                    box_count += bc
+                    if res:
+                        found = True
+                        break
+            else:  # Internal node
+                for child in ti.static(range(2)):
+                    if self.tlas_nodes[node.childIndex + child].boundingBox.hitSlab(ray.origin, inv_direction) < t_max:
+                        stack_ptr += 1
+                        stack[stack_ptr] = node.childIndex + child
+
+        recordStackDepth(deepest)
+        return found, triangle_count, box_count
+
+    @ti.func
+    def sampleLight(self, origin, xi):
+        """
+        Point on a light chosen uniformly in the light list, its emission and
+        the solid angle pdf of the direction from origin (0 if there is no light).
+
+        xi[0] picks the light and is then rescaled to [0, 1), so both uniforms
+        are still available to sample a point of the light.
+        """
+        point = origin
+        pdf = 0.
+        emission = Color(0., 0., 0.)
+        if ti.static(self.light_number > 0):
+            light_index = ti.min(int(xi[0] * self.light_number), self.light_number-1)
+            light = self.lights[light_index]
+            xi[0] = xi[0] * self.light_number - light_index
+            material_coord = MaterialCoord(0, 0)
+            if light[0] == SPHERE_PRIMITIVE:
+                sphere = self.sphere_buffer[light[1]]
+                point, pdf = sampleSphere(sphere, origin, xi)
+                material_coord = sphere.material_coord
+            else:
+                quad = self.quad_buffer[light[1]]
+                point, pdf = sampleQuad(quad, origin, xi)
+                material_coord = quad.material_coord
+            pdf /= self.light_number
+            emission = self.diffuseLight_materials[material_coord[1]].emmited()
+        return point, pdf, emission
+
+    @ti.func
+    def lightPdf(self, origin, hit):
+        """Pdf with which sampleLight picks the direction from origin to a hit on a light, 0 for other hits."""
+        pdf = 0.
+        if ti.static(self.light_number > 0):
+            primitive_type, index = hit.primitive[0], hit.primitive[1]
+            if hit.material_coord[0] == DIFFUSE_LIGHT_MATERIAL:
+                if primitive_type == SPHERE_PRIMITIVE:
+                    pdf = spherePdf(self.sphere_buffer[index], origin) / self.light_number
+                elif primitive_type == QUAD_PRIMITIVE:
+                    pdf = quadPdf(self.quad_buffer[index], origin, hit.hitPoint) / self.light_number
+        return pdf
+
+    @ti.func
+    def hit(self, ray, k):
+        closest_hit = HitInfo(didHit=False, dst=MAX_LEN)
+        triangle_count = 0
+        box_count = 0
+
+        # Hit distances are world distances, so boxes are tested with a unit direction
+        inv_direction = safeInverse(ti.math.normalize(ray.direction))
+        stack = ti.Vector([0] * 50)
+        stack_ptr = 0
+        deepest = 0
 
-        tmp = 0
-        if k == 0:
-            tmp = 1
+        while stack_ptr >= 0:
+            if ti.static(STATS):
+                deepest = ti.max(deepest, stack_ptr + 1)
+            node = self.tlas_nodes[stack[stack_ptr]]
+            stack_ptr -= 1
+            box_count += 1
 
-        for index in range(self.quad_number-1-tmp):
-            intersect = self.quad_buffer[index].hit(ray)
-            if intersect.dst < closest_hit.dst and intersect.didHit:
-                closest_hit = intersect
+            if node.childIndex == 0:  # Leaf node
+                for i in range(node.triangleIndex, node.triangleIndex + node.triangleCount):
+                    intersect, tc, bc = self.hitPrimitive(self.tlas_primitives[i], ray, k)
+                    triangle_count += tc
+                    box_count += bc
+                    if intersect.didHit and intersect.dst < closest_hit.dst:
+                        closest_hit = intersect
+            else:  # Internal node
+                leftChild = node.childIndex
+                rightChild = node.childIndex + 1
 
+                dstLeft = self.tlas_nodes[leftChild].boundingBox.hitSlab(ray.origin, inv_direction)
+                dstRight = self.tlas_nodes[rightChild].boundingBox.hitSlab(ray.origin, inv_direction)
 
-        for index in range(self.mesh_number-1):
-            intersect, tc, bc = self.mesh_buffer[index].hit(ray, self.triangle_buffer, self.bvhNode_buffer)
-            triangle_count += tc
-            box_count += bc
-            if intersect.dst < closest_hit.dst and intersect.didHit:
-                closest_hit = intersect
-                closest_hit.material_coord = self.mesh_buffer[0].material_coord
+                # Push children to stack in far-to-near order
+                if dstLeft < dstRight:
+                    if dstRight < closest_hit.dst:
+                        stack_ptr += 1
+                        stack[stack_ptr] = rightChild
+                    if dstLeft < closest_hit.dst:
+                        stack_ptr += 1
+                        stack[stack_ptr] = leftChild
+                else:
+                    if dstLeft < closest_hit.dst:
+                        stack_ptr += 1
+                        stack[stack_ptr] = leftChild
+                    if dstRight < closest_hit.dst:
+                        stack_ptr += 1
+                        stack[stack_ptr] = rightChild
 
+        recordStackDepth(deepest)
         return closest_hit, triangle_count, box_count
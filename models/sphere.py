@@ -16,21 +16,37 @@ class Sphere:
     center: Point
     radius: ti.f32
     material_coord: MaterialCoord
+    # Filled by Scene.precomputePrimitives
+    radius2: ti.f32
+    invRadius: ti.f32
 
     @ti.func
     def hit(self, ray:Ray) -> HitInfo:
         hitInf = HitInfo(didHit=False)
         oc = self.center - ray.origin
         a = dot(ray.direction, ray.direction)
-        b = -2.0*dot(ray.direction, oc)
-        c = dot(oc, oc) - self.radius*self.radius
-        discriminant = b*b - 4*a*c
+        h = dot(ray.direction, oc)
+        discriminant = h*h - a*(dot(oc, oc) - self.radius2)
+        # Most tests miss : the square root and the division only run for the others
         if discriminant >= 0:
-            dst = (-b - sqrt(discriminant) ) / (2.0*a)
+            dst = (h - sqrt(discriminant)) / a
             if dst >= 0:
                 hitInf.didHit = True
                 hitInf.hitPoint = ray.at(dst)
-                hitInf.normal = normalize(hitInf.hitPoint - self.center)
+                hitInf.normal = (hitInf.hitPoint - self.center) * self.invRadius
                 hitInf.dst = (ray.origin-hitInf.hitPoint).norm()
                 hitInf.material_coord = self.material_coord
         return hitInf
+
+    @ti.func
+    def occluded(self, ray:Ray, t_max):
+        # Any hit before the ray parameter t_max, without hit record
+        oc = self.center - ray.origin
+        a = dot(ray.direction, ray.direction)
+        h = dot(ray.direction, oc)
+        discriminant = h*h - a*(dot(oc, oc) - self.radius2)
+        res = False
+        if discriminant >= 0:
+            dst = (h - sqrt(discriminant)) / a
+            res = dst > EPS and dst < t_max
+        return res
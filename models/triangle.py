@@ -1,4 +1,5 @@
 import taichi as ti
+import numpy as np
 from taichi.math import normalize, cross
 import material
 from models.hit import HitInfo
@@ -24,37 +25,108 @@ class Triangle:
     @ti.func
     def hit(self, ray):
         hitInf = HitInfo(didHit=False)
-        T = ray.origin - self.v0
-        D = ray.direction
+        t = rayTriangleDistance(self.v0, self.e1, self.e2, ray)
+        if t > EPS:
+            hitInf.didHit = True
+            hitInf.hitPoint = ray.origin + t * ray.direction
+            hitInf.dst = t
+            hitInf.normal = -ti.math.sign(ti.math.dot(self.normal, ray.direction)) * self.normal
+            hitInf.material_coord = self.material_coord
 
-        # Precompute cross products
-        P = ti.math.cross(D, self.e2)
-        det = ti.math.dot(P, self.e1)
+        return hitInf
+
+    @ti.func
+    def occluded(self, ray, t_max):
+        t = rayTriangleDistance(self.v0, self.e1, self.e2, ray)
+        return t > EPS and t < t_max
+
+@ti.func
+def rayTriangleDistance(v0, e1, e2, ray):
+    # Möller–Trumbore, returns -1 when the ray misses the triangle
+    res = -1.
+    T = ray.origin - v0
+    D = ray.direction
+
+    # Precompute cross products
+    P = ti.math.cross(D, e2)
+    det = ti.math.dot(P, e1)
+
+    # Early exit for determinant close to zero
+    if ti.abs(det) > EPS:
+        inv_det = 1.0 / det
 
-        # Early exit for determinant close to zero
-        if ti.abs(det) > EPS:
-            inv_det = 1.0 / det
+        u = ti.math.dot(P, T) * inv_det
 
-            u = ti.math.dot(P, T) * inv_det
+        # Early exit if u is out of range
+        if u >= 0 and u <= 1:
+            Q = ti.math.cross(T, e1)
+            v = ti.math.dot(Q, D) * inv_det
 
-            # Early exit if u is out of range
-            if u >= 0 and u <= 1:
-                Q = ti.math.cross(T, self.e1)
-                v = ti.math.dot(Q, D) * inv_det
+            # Early exit if v is out of range
+            if v >= 0 and (u + v) <= 1:
+                res = ti.math.dot(Q, e2) * inv_det
+    return res
 
-                # Early exit if v is out of range
-                if v >= 0 and (u + v) <= 1:
-                    t = ti.math.dot(Q, self.e2) * inv_det
+@ti.data_oriented
+class IndexedTriangleBuffer:
+    """
+    Triangles stored as a shared vertex field and an int32 index field.
 
-                    if t > EPS:
-                        hitInf.didHit = True
-                        hitInf.hitPoint = ray.origin + t * D
-                        hitInf.dst = t
-                        hitInf.normal = -ti.math.sign(ti.math.dot(self.normal, D)) * self.normal
-                        hitInf.material_coord = self.material_coord
+    A Triangle record takes 80 bytes, this layout 12 bytes per triangle plus
+    12 bytes per vertex, i.e. about 18 bytes per triangle on a closed mesh
+    where there are half as many vertices as triangles. Edges and normal are
+    recomputed at intersection time.
+    """
+    def __init__(self, vertices, faces):
+        self.vertices = Point.field(shape=vertices.shape[0])
+        self.indices = ti.types.vector(3, ti.i32).field(shape=faces.shape[0])
+        self.vertices.from_numpy(np.ascontiguousarray(vertices, dtype=np.float32))
+        self.indices.from_numpy(np.ascontiguousarray(faces, dtype=np.int32))
+        self.shape = self.indices.shape
 
+    @ti.func
+    def hit(self, i, ray):
+        hitInf = HitInfo(didHit=False)
+        index = self.indices[i]
+        v0 = self.vertices[index[0]]
+        e1 = self.vertices[index[1]] - v0
+        e2 = self.vertices[index[2]] - v0
+        t = rayTriangleDistance(v0, e1, e2, ray)
+        if t > EPS:
+            normal = normalize(cross(e1, e2))
+            hitInf.didHit = True
+            hitInf.hitPoint = ray.origin + t * ray.direction
+            hitInf.dst = t
+            hitInf.normal = -ti.math.sign(ti.math.dot(normal, ray.direction)) * normal
         return hitInf
 
+    @ti.func
+    def occluded(self, i, ray, t_max):
+        index = self.indices[i]
+        v0 = self.vertices[index[0]]
+        t = rayTriangleDistance(v0, self.vertices[index[1]] - v0, self.vertices[index[2]] - v0, ray)
+        return t > EPS and t < t_max
+
+@ti.func
+def hitTriangle(triangle_buffer: ti.template(), i, ray):
+    # Works on a Triangle field as well as on an IndexedTriangleBuffer
+    hitInf = HitInfo(didHit=False)
+    if ti.static(isinstance(triangle_buffer, IndexedTriangleBuffer)):
+        hitInf = triangle_buffer.hit(i, ray)
+    else:
+        hitInf = triangle_buffer[i].hit(ray)
+    return hitInf
+
+@ti.func
+def occludedTriangle(triangle_buffer: ti.template(), i, ray, t_max):
+    # Any-hit version of hitTriangle, t_max is a ray parameter
+    res = False
+    if ti.static(isinstance(triangle_buffer, IndexedTriangleBuffer)):
+        res = triangle_buffer.occluded(i, ray, t_max)
+    else:
+        res = triangle_buffer[i].occluded(ray, t_max)
+    return res
+
 @ti.kernel
 def createTriangle(v0:Point, v1:Point, v2:Point, mat_coord:MaterialCoord) -> Triangle:
     e1 = v1 - v0
@@ -0,0 +1,249 @@
+import taichi as ti
+from constants import *
+from models.hit import HitInfo
+from models.ray import Ray
+from models.vector import Color
+from models.light import misWeight
+from models.integrator import ray_counter, directLight, russianRoulette
+from utils.sampler import Sampler, startSampler, BSDF_DIMENSION
+from utils import stats
+
+# Shading buckets: the four material ids of material_coord, then the misses
+MATERIAL_NUMBER = 4
+MISS_BUCKET = MATERIAL_NUMBER
+BUCKET_NUMBER = MATERIAL_NUMBER + 1
+
+
+@ti.data_oriented
+class WavefrontIntegrator:
+    """
+    Wavefront version of models.integrator.trace.
+
+    Instead of following every path to its end in one megakernel, the state
+    of one path per pixel lives in SoA fields and each bounce runs a chain of
+    kernels over a queue of the paths still alive: intersection, one shading
+    kernel per material type, then compaction of the queue. Every shading
+    kernel only runs the code of its own material, so lanes working on
+    different materials do not diverge inside one loop body.
+
+    With sort_materials, a counting sort groups the queue by material after
+    each intersection, and every shading kernel runs only over the
+    contiguous range of its own material instead of the whole queue.
+    """
+    def __init__(self, cam, scene, sort_materials=False) -> None:
+        self.cam = cam
+        self.scene = scene
+        self.sort_materials = sort_materials
+        self.res = cam.resolution
+        self.path_number = self.res[0] * self.res[1]
+
+        self.rays = Ray.field(shape=self.path_number, layout=ti.Layout.SOA)
+        self.hits = HitInfo.field(shape=self.path_number, layout=ti.Layout.SOA)
+        self.throughput = Color.field(shape=self.path_number)
+        self.radiance = Color.field(shape=self.path_number)
+        # Pdf of the last bounce, see trace
+        self.bsdf_pdf = ti.field(ti.f32, shape=self.path_number)
+        self.alive = ti.field(ti.i32, shape=self.path_number)
+        # Sample stream of each path, every bounce starts again from its own dimension
+        self.samplers = Sampler.field(shape=self.path_number, layout=ti.Layout.SOA)
+
+        self.queue = ti.field(ti.i32, shape=self.path_number)
+        self.next_queue = ti.field(ti.i32, shape=self.path_number)
+        self.queue_length = ti.field(ti.i32, shape=())
+        self.next_queue_length = ti.field(ti.i32, shape=())
+
+        # Range of the queue shaded by each bucket, the whole queue without sorting
+        self.sorted_queue = ti.field(ti.i32, shape=self.path_number)
+        self.bucket_start = ti.field(ti.i32, shape=BUCKET_NUMBER)
+        self.bucket_end = ti.field(ti.i32, shape=BUCKET_NUMBER)
+
+        self.color_buffer = ti.Vector.field(3, dtype=ti.f32, shape=self.res)
+
+    @ti.kernel
+    def generate(self, sample: ti.i32, seed: ti.u32):
+        for u, v in self.color_buffer:
+            path = u * self.res[1] + v
+            sampler = startSampler(u, v, sample, seed)
+            self.rays[path] = self.cam.get_ray(u, v, sampler)
+            self.samplers[path] = sampler
+            self.throughput[path] = Color(1., 1., 1.)
+            self.radiance[path] = Color(0., 0., 0.)
+            self.bsdf_pdf[path] = 0.
+            self.alive[path] = 1
+            self.queue[path] = path
+            stats.record(u, v, 1, 0, 0, 0, 0)
+        self.queue_length[None] = self.path_number
+
+    @ti.kernel
+    def intersect(self, k: ti.i32):
+        for i in range(self.queue_length[None]):
+            path = self.queue[i]
+            hitInfos, triangle_count, box_count = self.scene.hit(self.rays[path], k)
+            stats.record(self.samplers[path].x, self.samplers[path].y, 0, 1, box_count, triangle_count, 1)
+            hitInfos.didHit = hitInfos.didHit and hitInfos.dst >= 0.
+            self.hits[path] = hitInfos
+        ray_counter[None] += self.queue_length[None]
+        if ti.static(not self.sort_materials):
+            for bucket in range(BUCKET_NUMBER):
+                self.bucket_start[bucket] = 0
+                self.bucket_end[bucket] = self.queue_length[None]
+
+    @ti.func
+    def bucket(self, path):
+        hitInfos = self.hits[path]
+        bucket = MISS_BUCKET
+        if hitInfos.didHit:
+            bucket = hitInfos.material_coord[0]
+        return bucket
+
+    @ti.kernel
+    def sortByMaterial(self):
+        # Counting sort of the queue on the bucket of each path
+        for bucket in range(BUCKET_NUMBER):
+            self.bucket_end[bucket] = 0
+        for i in range(self.queue_length[None]):
+            self.bucket_end[self.bucket(self.queue[i])] += 1
+        ti.loop_config(serialize=True)
+        for bucket in range(BUCKET_NUMBER):
+            start = 0
+            if bucket > 0:
+                start = self.bucket_start[bucket-1] + self.bucket_end[bucket-1]
+            self.bucket_start[bucket] = start
+        # bucket_end counts up from bucket_start while the paths are placed
+        for bucket in range(BUCKET_NUMBER):
+            self.bucket_end[bucket] = self.bucket_start[bucket]
+        for i in range(self.queue_length[None]):
+            path = self.queue[i]
+            self.sorted_queue[ti.atomic_add(self.bucket_end[self.bucket(path)], 1)] = path
+
+    @ti.func
+    def shadedPath(self, i):
+        path = 0
+        if ti.static(self.sort_materials):
+            path = self.sorted_queue[i]
+        else:
+            path = self.queue[i]
+        return path
+
+    @ti.func
+    def continuePath(self, path, k, attenuation, ray, bounce, sampler: ti.template()):
+        if bounce:
+            throughput, survive = russianRoulette(self.throughput[path]*attenuation, k, sampler)
+            self.throughput[path] = throughput
+            self.rays[path] = ray
+            if not survive:
+                self.alive[path] = 0
+        else:
+            self.alive[path] = 0
+
+    @ti.kernel
+    def shadeMiss(self):
+        for i in range(self.bucket_start[MISS_BUCKET], self.bucket_end[MISS_BUCKET]):
+            path = self.shadedPath(i)
+            if not self.hits[path].didHit:
+                # No environment light, see trace
+                self.alive[path] = 0
+
+    @ti.kernel
+    def shadeLambertian(self, k: ti.i32):
+        for i in range(self.bucket_start[0], self.bucket_end[0]):
+            path = self.shadedPath(i)
+            hitInfos = self.hits[path]
+            if hitInfos.didHit and hitInfos.material_coord[0] == 0:
+                mat = self.scene.lambertian_materials[hitInfos.material_coord[1]]
+                self.radiance[path] += self.throughput[path]*mat.emmited()
+                ray = self.rays[path]
+                sampler = self.samplers[path]
+                sampler.startBounce(k)
+                if ti.static(NEXT_EVENT_ESTIMATION):
+                    direct, triangle_count, box_count = directLight(self.scene, ray, hitInfos, mat, sampler)
+                    self.radiance[path] += self.throughput[path]*direct
+                    ray_counter[None] += 1
+                    stats.record(sampler.x, sampler.y, 0, 1, box_count, triangle_count, 0)
+                sampler.startBounce(k, BSDF_DIMENSION)
+                attenuation, ray, bounce = mat.scatter(ray, hitInfos, sampler)
+                self.bsdf_pdf[path] = mat.pdf(hitInfos, ray.direction)
+                self.continuePath(path, k, attenuation, ray, bounce, sampler)
+
+    @ti.kernel
+    def shadeMetal(self, k: ti.i32):
+        for i in range(self.bucket_start[1], self.bucket_end[1]):
+            path = self.shadedPath(i)
+            hitInfos = self.hits[path]
+            if hitInfos.didHit and hitInfos.material_coord[0] == 1:
+                mat = self.scene.metal_materials[hitInfos.material_coord[1]]
+                self.radiance[path] += self.throughput[path]*mat.emmited()
+                sampler = self.samplers[path]
+                sampler.startBounce(k, BSDF_DIMENSION)
+                attenuation, ray, bounce = mat.scatter(self.rays[path], hitInfos, sampler)
+                self.bsdf_pdf[path] = 0.
+                self.continuePath(path, k, attenuation, ray, bounce, sampler)
+
+    @ti.kernel
+    def shadeDiffuseLight(self):
+        for i in range(self.bucket_start[2], self.bucket_end[2]):
+            path = self.shadedPath(i)
+            hitInfos = self.hits[path]
+            if hitInfos.didHit and hitInfos.material_coord[0] == 2:
+                mat = self.scene.diffuseLight_materials[hitInfos.material_coord[1]]
+                weight = 1.
+                if ti.static(NEXT_EVENT_ESTIMATION):
+                    if self.bsdf_pdf[path] > 0.:
+                        weight = misWeight(self.bsdf_pdf[path], self.scene.lightPdf(self.rays[path].origin, hitInfos))
+                self.radiance[path] += self.throughput[path]*mat.emmited()*weight
+                # Lights do not scatter
+                self.alive[path] = 0
+
+    @ti.kernel
+    def shadeDielectric(self, k: ti.i32):
+        for i in range(self.bucket_start[3], self.bucket_end[3]):
+            path = self.shadedPath(i)
+            hitInfos = self.hits[path]
+            if hitInfos.didHit and hitInfos.material_coord[0] == 3:
+                mat = self.scene.dielectric_materials[hitInfos.material_coord[1]]
+                self.radiance[path] += self.throughput[path]*mat.emmited()
+                sampler = self.samplers[path]
+                sampler.startBounce(k, BSDF_DIMENSION)
+                attenuation, ray, bounce = mat.scatter(self.rays[path], hitInfos, sampler)
+                self.bsdf_pdf[path] = 0.
+                self.continuePath(path, k, attenuation, ray, bounce, sampler)
+
+    @ti.kernel
+    def compact(self):
+        # Keeps the paths still alive at the front of the queue
+        self.next_queue_length[None] = 0
+        for i in range(self.queue_length[None]):
+            path = self.queue[i]
+            if self.alive[path]:
+                self.next_queue[ti.atomic_add(self.next_queue_length[None], 1)] = path
+        self.queue_length[None] = self.next_queue_length[None]
+        for i in range(self.queue_length[None]):
+            self.queue[i] = self.next_queue[i]
+
+    @ti.kernel
+    def accumulate(self):
+        for u, v in self.color_buffer:
+            self.color_buffer[u, v] += self.radiance[u * self.res[1] + v]
+
+    def shade(self, k):
+        self.shadeMiss()
+        self.shadeLambertian(k)
+        self.shadeMetal(k)
+        self.shadeDiffuseLight()
+        self.shadeDielectric(k)
+
+    def render(self, spp, first_sample=0, seed=0):
+        """
+        Add spp samples per pixel to color_buffer, starting at the sample
+        number first_sample of the sequences of seed. The kernels are only
+        launched, the host does not wait for them.
+        """
+        for s in range(spp):
+            self.generate(first_sample + s, seed)
+            for k in range(MAX_BOUNCE):
+                self.intersect(k)
+                if self.sort_materials:
+                    self.sortByMaterial()
+                self.shade(k)
+                self.compact()
+            self.accumulate()
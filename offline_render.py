@@ -0,0 +1,301 @@
+"""
+Headless renderer : renders a scene module to a file, without any GUI.
+
+    python offline_render.py scenes.la_valse_cornellbox --arch cpu --spp 256 -o la_valse.png
+    python offline_render.py scenes/la_valse_cornellbox.py --time-budget 600 --checkpoint-interval 32 -o la_valse.exr
+    python offline_render.py scenes.la_valse_cornellbox --spp 4096 --adaptive 0.005 -o la_valse.png
+    python offline_render.py scenes.la_valse_cornellbox --integrator wavefront --spp 64 -o la_valse.png
+    python offline_render.py scenes.la_valse_cornellbox --spp 4096 --time-budget 3600 --checkpoint-interval 64 --resume -o la_valse.png
+    python offline_render.py scenes.la_valse_cornellbox --spp 64 --stats-json la_valse_stats.json -o la_valse.png
+"""
+import argparse
+import importlib
+import os
+import signal
+import time
+import numpy as np
+import taichi as ti
+from utils.adaptive_sampling import AdaptiveSampler, TILE_SIZE, MIN_SPP
+from utils.tone_mapping import ToneMapper, TONE_MAPPINGS
+from utils.checkpoint import save_checkpoint, load_checkpoint, restore_fields
+from utils import stats
+from constants import STATS
+
+ARCHS = {'cpu': 'cpu', 'gpu': 'gpu', 'cuda': 'cuda', 'vulkan': 'vulkan', 'metal': 'metal'}
+FORMATS = ('png', 'npy', 'exr', 'hdr')
+INTEGRATORS = ('megakernel', 'wavefront')
+# ray_counter is folded into a (high, low) pair of i32 after every launch so it never overflows
+RAY_COUNT_BASE = 1 << 30
+
+
+def module_name(name):
+    # Accept scenes/la_valse_cornellbox.py as well as scenes.la_valse_cornellbox
+    if name.endswith('.py'):
+        name = os.path.normpath(name)[:-3].replace(os.sep, '.')
+    return name
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Render a scene offline, without any GUI.")
+    parser.add_argument('scene', help="scene module, e.g. scenes.la_valse_cornellbox or scenes/la_valse_cornellbox.py")
+    parser.add_argument('--fragment', default='fragments.raytrace_frag', help="fragment module (default: fragments.raytrace_frag)")
+    parser.add_argument('--integrator', choices=INTEGRATORS, default='megakernel', help="megakernel: the fragment traces whole paths, wavefront: one kernel per stage (default: megakernel)")
+    parser.add_argument('--sort-materials', action='store_true', help="wavefront: sort the hits by material before shading")
+    parser.add_argument('--arch', choices=ARCHS, default='cpu', help="taichi backend (default: cpu)")
+    parser.add_argument('--spp', type=int, default=64, help="samples per pixel (default: 64)")
+    parser.add_argument('--spp-per-launch', type=int, default=8, help="samples per pixel traced by each kernel launch (default: 8)")
+    parser.add_argument('--adaptive', type=float, default=None, metavar='THRESHOLD', help="adaptive sampling: retire the tiles whose RMS standard error is below THRESHOLD (e.g. 0.005)")
+    parser.add_argument('--tile-size', type=int, default=TILE_SIZE, help=f"adaptive sampling tile size (default: {TILE_SIZE})")
+    parser.add_argument('--min-spp', type=int, default=MIN_SPP, help=f"adaptive sampling: samples per pixel before a tile can be retired (default: {MIN_SPP})")
+    parser.add_argument('--time-budget', type=float, default=None, help="stop after this many seconds, even if spp is not reached")
+    parser.add_argument('--checkpoint-interval', type=int, default=0, help="write the output and the checkpoint every N samples (default: only at the end)")
+    parser.add_argument('--checkpoint', default=None, help="checkpoint file of the float accumulation (default: the output name with .checkpoint.npz)")
+    parser.add_argument('--resume', action='store_true', help="start from the checkpoint if it exists")
+    parser.add_argument('-o', '--output', default='render.png', help="output file (default: render.png)")
+    parser.add_argument('--format', choices=FORMATS, default=None, help="output format (default: from the output extension)")
+    parser.add_argument('--gamma', type=float, default=2.2, help="gamma of the png output (default: 2.2)")
+    parser.add_argument('--exposure', type=float, default=1., help="exposure of the png output (default: 1)")
+    parser.add_argument('--tonemap', choices=TONE_MAPPINGS, default='none', help="tone mapping of the png output (default: none, radiance is clipped)")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the sample sequences, the same seed renders the same image")
+    parser.add_argument('--stats-json', default=None, help="write the counters and stage timings of utils/stats.py to this file")
+    args = parser.parse_args(argv)
+
+    if args.format is None:
+        extension = os.path.splitext(args.output)[1][1:].lower()
+        if extension not in FORMATS:
+            parser.error(f"cannot infer the format of {args.output}, use --format")
+        args.format = extension
+    if args.integrator == 'wavefront' and (args.adaptive is not None or args.fragment != 'fragments.raytrace_frag'):
+        parser.error("the wavefront integrator only renders radiance, without adaptive sampling")
+    if args.spp < 1 or args.spp_per_launch < 1:
+        parser.error("--spp and --spp-per-launch must be at least 1")
+    if args.stats_json is not None and not STATS:
+        parser.error("--stats-json needs STATS = True in constants.py")
+    if args.checkpoint is None:
+        args.checkpoint = os.path.splitext(args.output)[0] + '.checkpoint.npz'
+    return args
+
+
+def save_image(img, path, image_format):
+    """
+    Write an upright image of shape (height, width, 3).
+
+    png takes the 8-bit image of a ToneMapper, npy/exr/hdr the raw averaged
+    radiance.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if image_format == 'npy':
+        np.save(path, np.ascontiguousarray(img))
+    elif image_format == 'png':
+        from PIL import Image
+        Image.fromarray(img).save(path)
+    else:
+        import imageio
+        imageio.imwrite(path, np.ascontiguousarray(img, dtype=np.float32))
+
+
+def paint_samples_kernel(color_buffer, cam, scene, fragment):
+    """
+    Kernel adding spp_per_launch samples of every pixel, numbered from
+    first_sample, to color_buffer. Must be called after ti.init.
+
+    Returns:
+        paintSamples(spp_per_launch: i32, first_sample: i32, seed: u32)
+    """
+    from utils.sampler import startSampler
+    res = cam.resolution
+
+    @ti.kernel
+    def paintSamples(spp_per_launch: ti.i32, first_sample: ti.i32, seed: ti.u32):
+        for u, v in color_buffer:
+            # Samples are summed in registers, the buffer is written once per launch
+            new_color = ti.Vector.zero(ti.f32, 3)
+            for s in range(spp_per_launch):
+                sampler = startSampler(u, v, first_sample + s, seed)
+                ray = cam.get_ray(u, v, sampler)
+                new_color += fragment(ray, u, v, res, scene, sampler)
+            color_buffer[u, v] += new_color
+
+    return paintSamples
+
+
+def render(args):
+    checkpoint = None
+    if args.resume and os.path.exists(args.checkpoint):
+        checkpoint = load_checkpoint(args.checkpoint)
+        args.seed = checkpoint['seed']
+    ti.init(arch=getattr(ti, ARCHS[args.arch]), kernel_profiler=STATS)
+
+    # Scenes build their fields and buffers at import, so they are imported after ti.init
+    with stats.stage('scene'):
+        scene_module = importlib.import_module(module_name(args.scene))
+        fragment = importlib.import_module(module_name(args.fragment)).fragment
+    from models.integrator import ray_counter
+
+    scene, cam = scene_module.scene, scene_module.cam
+    res = cam.resolution
+    pixels = res[0] * res[1]
+    ray_count = ti.field(ti.i32, shape=2)
+    stats.allocate(res)
+
+    @ti.kernel
+    def fold_ray_count():
+        ray_count[1] += ray_counter[None]
+        ray_counter[None] = 0
+        if ray_count[1] >= RAY_COUNT_BASE:
+            ray_count[0] += 1
+            ray_count[1] -= RAY_COUNT_BASE
+
+    if args.adaptive is not None:
+        sampler = AdaptiveSampler(cam, scene, fragment, tile_size=args.tile_size, threshold=args.adaptive, min_spp=args.min_spp)
+        image = sampler.image
+        state = {'color_buffer': sampler.color_buffer, 'sample_count': sampler.sample_count,
+                 'luminance_mean': sampler.luminance_mean, 'luminance_m2': sampler.luminance_m2}
+
+        def accumulation():
+            return sampler.color_buffer, sampler.sample_count
+
+        def paint(spp_per_launch, first_sample):
+            # Every pixel indexes its samples with its own sample count
+            sampler.sample(spp_per_launch, args.seed)
+
+        def traced_samples():
+            return int(sampler.sample_count.to_numpy().sum(dtype=np.int64))
+    elif args.integrator == 'wavefront':
+        from models.wavefront import WavefrontIntegrator
+        integrator = WavefrontIntegrator(cam, scene, sort_materials=args.sort_materials)
+
+        def paint(spp_per_launch, first_sample):
+            integrator.render(spp_per_launch, first_sample, args.seed)
+        state = {'color_buffer': integrator.color_buffer}
+
+        def image():
+            return integrator.color_buffer.to_numpy() / samples
+
+        def accumulation():
+            return integrator.color_buffer, samples
+
+        def traced_samples():
+            return samples * pixels
+    else:
+        color_buffer = ti.Vector.field(3, dtype=ti.f32, shape=res)
+        state = {'color_buffer': color_buffer}
+        paintSamples = paint_samples_kernel(color_buffer, cam, scene, fragment)
+
+        def paint(spp_per_launch, first_sample):
+            paintSamples(spp_per_launch, first_sample, args.seed)
+
+        def image():
+            return color_buffer.to_numpy() / samples
+
+        def accumulation():
+            return color_buffer, samples
+
+        def traced_samples():
+            return samples * pixels
+
+    tone_mapper = ToneMapper(res, tone_mapping=args.tonemap, exposure=args.exposure, gamma=args.gamma)
+
+    def write_output():
+        # Images are written upright, like the "s" key of render.py
+        with stats.stage('output'):
+            if args.format == 'png':
+                tone_mapper.develop(*accumulation())
+                save_image(tone_mapper.image(), args.output, args.format)
+            else:
+                save_image(np.rot90(image(), k=1), args.output, args.format)
+
+    # Checked on resume, the buffers of another render must not be mixed in
+    metadata = {'scene': module_name(args.scene), 'fragment': module_name(args.fragment), 'integrator': args.integrator,
+                'adaptive': -1. if args.adaptive is None else args.adaptive, 'width': res[0], 'height': res[1]}
+
+    def write_checkpoint():
+        with stats.stage('checkpoint'):
+            save_checkpoint(args.checkpoint, state, samples, args.seed, **metadata)
+
+    samples = 0
+    if checkpoint is not None:
+        for name, value in metadata.items():
+            if checkpoint['metadata'].get(name) != value:
+                raise SystemExit(f"{args.checkpoint} was written with {name} {checkpoint['metadata'].get(name)}, not {value}")
+        restore_fields(state, checkpoint)
+        samples = checkpoint['samples']
+        if args.adaptive is not None and samples >= args.min_spp:
+            sampler.update_tiles()
+        print(f"resumed from {args.checkpoint} at {samples} samples per pixel")
+    resumed_samples = traced_samples()
+
+    # Preempted nodes get a SIGTERM : the current launch ends and the checkpoint is written
+    terminated = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: terminated.append(signum))
+
+    # First launch compiles the kernel, it is not part of the timings
+    compile_start = time.perf_counter()
+    if samples < args.spp:
+        with stats.stage('compile'):
+            paint(1, samples)
+            fold_ray_count()
+        samples += 1
+    ti.sync()
+    first_samples = traced_samples()
+    first_spp = samples
+    print(f"{res[0]}x{res[1]} | {args.arch} | kernel compiled and first sample in {time.perf_counter() - compile_start:.2f}s")
+
+    start = time.perf_counter()
+    while samples < args.spp and not terminated:
+        if args.time_budget is not None:
+            # Launches are asynchronous, without the sync the host would queue samples past the budget
+            ti.sync()
+            elapsed = time.perf_counter() - start
+            # Stop when the next launch would not fit in the budget
+            if elapsed + elapsed / max(samples - first_spp, 1) * args.spp_per_launch >= args.time_budget:
+                break
+        spp_per_launch = min(args.spp_per_launch, args.spp - samples)
+        with stats.stage('render'):
+            paint(spp_per_launch, samples)
+            fold_ray_count()
+        samples += spp_per_launch
+        if args.adaptive is not None and samples >= args.min_spp:
+            with stats.stage('tiles'):
+                active_tiles = sampler.update_tiles()
+            if active_tiles == 0:
+                break
+        if args.checkpoint_interval > 0 and samples // args.checkpoint_interval != (samples - spp_per_launch) // args.checkpoint_interval:
+            write_output()
+            write_checkpoint()
+            print(f"checkpoint : {samples}/{args.spp} samples")
+    ti.sync()
+    elapsed = time.perf_counter() - start
+
+    write_output()
+    if args.checkpoint_interval > 0 or args.resume or terminated:
+        write_checkpoint()
+    high, low = ray_count.to_numpy()
+    rays = int(high) * RAY_COUNT_BASE + int(low)
+    total_samples = traced_samples()
+    # Samples of this run only, the first launch is not timed
+    run_samples = total_samples - resumed_samples
+    timed_samples = total_samples - first_samples
+    if terminated:
+        print(f"terminated, resume with --resume from {args.checkpoint}")
+    print(f"{samples} samples per pixel written to {args.output}")
+    if args.adaptive is not None:
+        print(f"adaptive : {total_samples / pixels:.1f} samples per pixel on average, {sampler.active_tile_number[None]}/{sampler.tile_number} tiles still active")
+    if timed_samples > 0 and elapsed > 0:
+        timed_rays = rays * timed_samples / run_samples
+        print(f"{timed_samples / elapsed:,.0f} samples/s | {timed_rays / elapsed:,.0f} rays/s | {rays / run_samples:.2f} rays per path | {elapsed:.2f}s")
+    if STATS:
+        # Counters of this run only, the samples of a checkpoint are not counted again
+        frame = stats.summary()
+        stats.print_summary(frame)
+        if args.stats_json is not None:
+            stats.dump_json(args.stats_json, frame, scene=module_name(args.scene), fragment=module_name(args.fragment),
+                            integrator=args.integrator, arch=args.arch, width=res[0], height=res[1], spp=samples, seed=args.seed)
+            print(f"stats written to {args.stats_json}")
+    return samples
+
+
+if __name__ == '__main__':
+    render(parse_args())
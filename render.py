@@ -1,46 +1,87 @@
 import taichi as ti
 import numpy as np
-ti.init(arch=ti.gpu)
+from constants import STATS
+ti.init(arch=ti.gpu, kernel_profiler=STATS)
 from PIL import Image
 import os
 
 from fragments.bounce_count_frag import fragment
-from utils.gamma_correction import gamma_correction
+from utils.tone_mapping import ToneMapper
 from models.vector import Vec3, Color
+from utils.sampler import startSampler
+from utils.adaptive_sampling import AdaptiveSampler, MIN_SPP
+from utils import stats
 
 from scenes.la_valse_cornellbox import scene, cam
 res = cam.resolution
 color_buffer = ti.Vector.field(3, dtype=ti.f32, shape=res)
+stats.allocate(res)
+
+# Samples traced per pixel by each launch of paint, the host only syncs between launches
+SPP_PER_LAUNCH = 4
+# Seed of the sample sequences, the same seed renders the same image
+SEED = 0
+# Stop sampling the screen tiles which are already converged
+ADAPTIVE_SAMPLING = False
+adaptive_sampler = AdaptiveSampler(cam, scene, fragment) if ADAPTIVE_SAMPLING else None
+# The debug fragments output colors, not radiance : shown linear, without tone mapping
+tone_mapper = ToneMapper(res, tone_mapping='none', exposure=1., gamma=1.)
 
 @ti.kernel
-def paint():
+def paint(spp_per_launch: ti.i32, first_sample: ti.i32, seed: ti.u32):
     x_len, y_len = res[0], res[1]
     for u, v in color_buffer:
-        ray = cam.get_ray(u, v)
-        new_color = fragment(ray, u, v, res, scene)
+        new_color = ti.Vector.zero(ti.f32, color_buffer.n)
+        for s in range(spp_per_launch):
+            sampler = startSampler(u, v, first_sample + s, seed)
+            ray = cam.get_ray(u, v, sampler)
+            new_color += fragment(ray, u, v, res, scene, sampler)
         color_buffer[u, v] += new_color
 
-number_of_cast = 1
+number_of_cast = SPP_PER_LAUNCH
 position = [0.01, 0.99]
-gui = ti.GUI("RayTracer", res)
+# fast_gui copies the 8-bit display buffer to the window without going through the host
+gui = ti.GUI("RayTracer", res, fast_gui=True)
 
 
 while True :
-    paint()
-    img = color_buffer.to_numpy() * (1 / number_of_cast)
-    max_r = np.rint(np.max(img[:, :, 0])*600)
-    mean_r = np.rint(np.mean(img[:, :, 0])*600)
-    #img = gamma_correction(img)
-    gui.set_image(img)
+    if ADAPTIVE_SAMPLING:
+        with stats.stage('paint'):
+            adaptive_sampler.sample(SPP_PER_LAUNCH, SEED)
+        if number_of_cast >= MIN_SPP:
+            with stats.stage('tiles'):
+                adaptive_sampler.update_tiles()
+        with stats.stage('develop'):
+            display = tone_mapper.develop(adaptive_sampler.color_buffer, adaptive_sampler.sample_count)
+    else:
+        with stats.stage('paint'):
+            paint(SPP_PER_LAUNCH, number_of_cast - SPP_PER_LAUNCH, SEED)
+        with stats.stage('develop'):
+            display = tone_mapper.develop(color_buffer, number_of_cast)
+    with stats.stage('display'):
+        gui.set_image(display)
     #gui.text(content=f"{number_of_cast}", pos=position, font_size=20, color=0xFFFFFF)
-    print(f"number of cast : {number_of_cast} | maximum intersection tests : {max_r} | mean intersection tests {mean_r}", end='\r')
+    if STATS:
+        # Counters recorded by trace, see utils/stats.py
+        means = stats.pixel_means()
+        tests = means['box_tests'] + means['triangle_tests']
+        print(f"number of cast : {number_of_cast} | maximum intersection tests : {tests.max():.0f} | mean intersection tests {tests.mean():.0f}", end='\r')
+    else:
+        print(f"number of cast : {number_of_cast}", end='\r')
     for e in gui.get_events(gui.PRESS):
                 if e.key == gui.ESCAPE:
                     gui.running = False
                 elif e.key == "s":
-                    img = np.rot90(img, k=1)
-                    output_image = Image.fromarray((img * 255).astype(np.uint8))
+                    output_image = Image.fromarray(tone_mapper.image())
                     output_image.save(f"dragon_{number_of_cast}.png")
+                elif e.key == "l" and STATS:
+                    lengths = stats.pixel_means()['path_length']
+                    print(f"\nmean path length : {lengths.mean():.2f} | maximum path length {lengths.max():.2f}")
+                elif e.key == "p" and STATS:
+                    # Counters and timings of the frames since the last "p"
+                    print()
+                    stats.print_summary()
+                    stats.reset()
 
     gui.show()
-    number_of_cast += 1
+    number_of_cast += SPP_PER_LAUNCH
@@ -0,0 +1,89 @@
+"""
+Fixed spp convergence regression : renders a scene with a fixed number of
+samples per pixel and compares it with a high spp reference.
+
+    python rmse_regression.py scenes.la_valse_cornellbox --reference la_valse_ref.npy --spp 64 --max-rmse 0.06
+
+The reference is rendered first when the file does not exist yet. RMSE is
+measured on images clipped to [0, 1], like the png output, so a few
+fireflies do not dominate it. The script exits with 1 when the RMSE is above
+--max-rmse or the mean radiance drifts from the reference by more than
+--max-bias, so it can run in CI.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import numpy as np
+
+OFFLINE_RENDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'offline_render.py')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compare a fixed spp render with a high spp reference.")
+    parser.add_argument('scene', help="scene module, e.g. scenes.la_valse_cornellbox or scenes/la_valse_cornellbox.py")
+    parser.add_argument('--reference', required=True, help="reference .npy image, rendered when missing")
+    parser.add_argument('--reference-spp', type=int, default=2048, help="samples per pixel of the reference (default: 2048)")
+    parser.add_argument('--spp', type=int, default=64, help="samples per pixel of the tested render (default: 64)")
+    parser.add_argument('--max-rmse', type=float, default=None, help="fail above this RMSE")
+    parser.add_argument('--max-bias', type=float, default=0.02, help="fail when the mean radiance is off by more than this ratio (default: 0.02)")
+    parser.add_argument('--arch', default='cpu', help="taichi backend (default: cpu)")
+    parser.add_argument('--seed', type=int, default=0, help="random seed of the tested render")
+    parser.add_argument('-o', '--output', default=None, help="keep the tested render in this .npy file")
+    return parser.parse_args(argv)
+
+
+def offline_render(scene, spp, output, arch, seed, extra=()):
+    command = [sys.executable, OFFLINE_RENDER, scene, '--spp', str(spp), '--spp-per-launch', '16',
+               '--arch', arch, '--seed', str(seed), '--format', 'npy', '-o', output, *extra]
+    subprocess.run(command, check=True)
+    return np.load(output)
+
+
+def rmse(img, reference):
+    """
+    Root mean square error of two radiance images clipped to [0, 1].
+
+    Parameters:
+        img (np.ndarray): Tested image.
+        reference (np.ndarray): Reference image of the same shape.
+
+    Returns:
+        float: RMSE over all pixels and channels.
+    """
+    return float(np.sqrt(np.mean((np.clip(img, 0, 1) - np.clip(reference, 0, 1)) ** 2)))
+
+
+def main(args):
+    if not os.path.exists(args.reference):
+        print(f"rendering the reference at {args.reference_spp} spp")
+        # Another seed, so the reference noise is not correlated with the tested render
+        offline_render(args.scene, args.reference_spp, args.reference, args.arch, args.seed + 1)
+    reference = np.load(args.reference)
+
+    output = args.output
+    if output is None:
+        output = os.path.splitext(args.reference)[0] + f"_{args.spp}spp.npy"
+    img = offline_render(args.scene, args.spp, output, args.arch, args.seed)
+    if img.shape != reference.shape:
+        print(f"the reference is {reference.shape[1]}x{reference.shape[0]}, the render {img.shape[1]}x{img.shape[0]}")
+        return 1
+
+    error = rmse(img, reference)
+    bias = float(img.mean() / max(reference.mean(), 1e-12) - 1.)
+    print(f"{args.spp} spp | rmse {error:.4f} | mean radiance {bias:+.2%} from the reference")
+
+    failed = False
+    if args.max_rmse is not None and error > args.max_rmse:
+        print(f"FAILED : rmse {error:.4f} above {args.max_rmse}")
+        failed = True
+    if abs(bias) > args.max_bias:
+        print(f"FAILED : mean radiance off by {bias:+.2%}")
+        failed = True
+    if args.output is None:
+        os.remove(output)
+    return int(failed)
+
+
+if __name__ == '__main__':
+    sys.exit(main(parse_args()))
@@ -6,10 +6,10 @@ from models.quad import Quad, create_quad
 from models.scene import Scene
 from models.triangle import Triangle
 from constants import *
-from utils.create_buffers import quadListToBuffer, sphereListToBuffer, meshListToBuffer
-from utils.make_matrix import make_transform_mat
+from utils.create_buffers import quadListToBuffer, sphereListToBuffer, meshListToBuffer, meshAssetToBuffers, meshAssetToWideBuffer
 import numpy as np
-from models.mesh import BVHNode, Mesh
+from models.mesh import BVHNode, Mesh, create_mesh
+from bvh.asset_cache import load_mesh_asset
 
 aspect_ratio = 1.
 lookfrom = Point(278., 278., -800.)
@@ -55,27 +55,23 @@ quad_list = [qu1, qu2, qu3, qu4, qu5, qu6, qu7]
 quad_buffer = quadListToBuffer(quad_list=quad_list)
 
 
-triangle_numpy = np.load('meshes/la_valse_triangle.npy', allow_pickle=True).item()
-triangle_number = len(triangle_numpy['v0'])
+mesh_asset = load_mesh_asset('meshes/la_valse.obj')
+triangle_number = mesh_asset[0]['triangle_number']
 print(f"Chargement de {triangle_number} triangles")
-triangle_buffer = Triangle.field(shape=(triangle_number+1))
-triangle_buffer.from_numpy(triangle_numpy)
-
-bvhNodes_numpy = np.load('meshes/la_valse_nodes.npy', allow_pickle=True).item()
-node_number = len(bvhNodes_numpy['childIndex'])
-bvhNode_buffer = BVHNode.field(shape=node_number)
-bvhNode_buffer.from_numpy(bvhNodes_numpy)
-
-
-transform = make_transform_mat(
-    #ti.Vector([278.0, 240.0, 250.0]),  # translation
-    ti.Vector([278.0, 240.0, 250.0]),  # translation
-    ti.Vector([180.0, 180.0, 0.0]), # rotation (degrees)
-    ti.Vector([1., 1., 1.])   # scale
+INDEXED_TRIANGLES = True
+STACKLESS_BVH = False
+WIDE_BVH = False
+triangle_buffer, bvhNode_buffer = meshAssetToBuffers(mesh_asset, indexed=INDEXED_TRIANGLES)
+wideBVHNode_buffer = meshAssetToWideBuffer(mesh_asset) if WIDE_BVH else None
+
+
+me1 = create_mesh(beginIndex= 0, meshLen= triangle_number, material_coord=(0, 1),
+    #translation=ti.Vector([278.0, 240.0, 250.0]),
+    translation=ti.Vector([278.0, 240.0, 250.0]),
+    rotation=ti.Vector([180.0, 180.0, 0.0]), # degrees
+    scale=ti.Vector([1., 1., 1.])
 )
-
-me1 = Mesh(beginIndex= 0, meshLen= triangle_number, material_coord=(0, 1), worldToLocal=transform)
 mesh_buffer = meshListToBuffer([me1])
 
 
-scene = Scene(sphere_buffer=sphere_buffer, quad_buffer=quad_buffer, triangle_buffer=triangle_buffer, bvhNode_buffer=bvhNode_buffer, mesh_buffer=mesh_buffer, lamb_materials=lambertian_materials, metal_materials=metal_materials, diffuseLight_materials=diffuseLight_materials)
+scene = Scene(sphere_buffer=sphere_buffer, quad_buffer=quad_buffer, triangle_buffer=triangle_buffer, bvhNode_buffer=bvhNode_buffer, mesh_buffer=mesh_buffer, lamb_materials=lambertian_materials, metal_materials=metal_materials, diffuseLight_materials=diffuseLight_materials, stackless_bvh=STACKLESS_BVH, wideBVHNode_buffer=wideBVHNode_buffer)
@@ -1,38 +1,56 @@
 import taichi as ti
-import numpy as np
 ti.init(arch=ti.gpu)
 
 from fragments.triangle_tested_frag import fragment
 from utils.gamma_correction import gamma_correction
 from models.vector import Vec3, Color
+from utils.sampler import startSampler
+from utils import stats
 
 from scenes.nike_of_samothrace_cornellbox import scene, cam
 res = cam.resolution
 color_buffer = ti.Vector.field(1, dtype=ti.f32, shape=res)
+stats.allocate(res)
+
+# Samples traced per pixel by each launch of paint, the host only syncs between launches
+SPP_PER_LAUNCH = 4
+# Seed of the sample sequences, the same seed renders the same image
+SEED = 0
+# Pixels testing more triangles per sample than this are shown white
+TRIANGLE_TESTS_THRESHOLD = 30
+display_buffer = ti.Vector.field(3, dtype=ti.u8, shape=res)
 
 @ti.kernel
-def paint():
+def paint(spp_per_launch: ti.i32, first_sample: ti.i32, seed: ti.u32):
     x_len, y_len = res[0], res[1]
     for u, v in color_buffer:
-        ray = cam.get_ray(u, v)
-        new_color = fragment(ray, u, v, res, scene)
+        new_color = ti.Vector.zero(ti.f32, color_buffer.n)
+        for s in range(spp_per_launch):
+            sampler = startSampler(u, v, first_sample + s, seed)
+            ray = cam.get_ray(u, v, sampler)
+            new_color += fragment(ray, u, v, res, scene, sampler)
         color_buffer[u, v] += new_color
 
-number_of_cast = 1
+@ti.kernel
+def develop(samples: ti.i32):
+    # Mean and threshold on the device, the host never reads the float buffer
+    for u, v in display_buffer:
+        value = ti.select(color_buffer[u, v][0] / samples > TRIANGLE_TESTS_THRESHOLD, 255, 0)
+        display_buffer[u, v] = ti.Vector([value, value, value]).cast(ti.u8)
+
+number_of_cast = SPP_PER_LAUNCH
 position = [0.01, 0.99]
-gui = ti.GUI("RayTracer", res)
+# fast_gui copies the 8-bit display buffer to the window without going through the host
+gui = ti.GUI("RayTracer", res, fast_gui=True)
 
-while True <= 20:
+while gui.running:
     for e in gui.get_events(gui.PRESS):
                 if e.key == gui.ESCAPE:
                     gui.running = False
-    paint()
-    img = color_buffer.to_numpy()
-    ma = np.amax(img)
-    img = img/number_of_cast
-    img = np.where(img > 30, img, 0)
-    gui.set_image(img)
+    paint(SPP_PER_LAUNCH, number_of_cast - SPP_PER_LAUNCH, SEED)
+    develop(number_of_cast)
+    gui.set_image(display_buffer)
     #gui.text(content=f"{number_of_cast}", pos=position, font_size=20, color=0xFFFFFF)
     print(f"number of sample calculated : {number_of_cast}", end='\r')
     gui.show()
-    number_of_cast += 1
+    number_of_cast += SPP_PER_LAUNCH
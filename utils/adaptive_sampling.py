@@ -0,0 +1,135 @@
+import taichi as ti
+import numpy as np
+from utils.sampler import startSampler
+
+TILE_SIZE = 16
+# RMS standard error of the tone mapped luminance of a tile under which it is retired
+ERROR_THRESHOLD = 0.01
+# Samples every pixel gets before its error estimate is trusted
+MIN_SPP = 16
+
+
+@ti.func
+def luminance(color):
+    return 0.2126 * color[0] + 0.7152 * color[1] + 0.0722 * color[2]
+
+
+@ti.data_oriented
+class AdaptiveSampler:
+    """
+    Progressive renderer that only samples the screen tiles which are not converged yet.
+
+    Next to the accumulation buffer, every pixel keeps its sample count and a
+    running mean and variance of its tone mapped luminance (Welford).
+    update_tiles retires the tiles whose RMS standard error is below the
+    threshold and packs the others in active_tiles, so sample launches
+    run one thread per pixel of an active tile only.
+    """
+    def __init__(self, cam, scene, fragment, tile_size=TILE_SIZE, threshold=ERROR_THRESHOLD, min_spp=MIN_SPP) -> None:
+        self.cam = cam
+        self.scene = scene
+        self.fragment = fragment
+        self.res = cam.resolution
+        self.tile_size = tile_size
+        self.threshold = threshold
+        self.min_spp = min_spp
+        self.tiles = ((self.res[0] + tile_size - 1) // tile_size, (self.res[1] + tile_size - 1) // tile_size)
+        self.tile_number = self.tiles[0] * self.tiles[1]
+
+        self.color_buffer = ti.Vector.field(3, dtype=ti.f32, shape=self.res)
+        self.sample_count = ti.field(ti.i32, shape=self.res)
+        self.luminance_mean = ti.field(ti.f32, shape=self.res)
+        self.luminance_m2 = ti.field(ti.f32, shape=self.res)
+
+        self.tile_error = ti.field(ti.f32, shape=self.tiles)
+        self.active_tiles = ti.field(ti.i32, shape=self.tile_number)
+        self.active_tile_number = ti.field(ti.i32, shape=())
+        self.reset()
+
+    @ti.kernel
+    def reset(self):
+        for u, v in self.color_buffer:
+            self.color_buffer[u, v] = ti.Vector.zero(ti.f32, 3)
+            self.sample_count[u, v] = 0
+            self.luminance_mean[u, v] = 0.
+            self.luminance_m2[u, v] = 0.
+        for tile in self.active_tiles:
+            self.active_tiles[tile] = tile
+        self.active_tile_number[None] = self.tile_number
+
+    @ti.kernel
+    def sample(self, spp_per_launch: ti.i32, seed: ti.u32):
+        tile_area = self.tile_size * self.tile_size
+        for i in range(self.active_tile_number[None] * tile_area):
+            tile = self.active_tiles[i // tile_area]
+            u = (tile % self.tiles[0]) * self.tile_size + (i % tile_area) % self.tile_size
+            v = (tile // self.tiles[0]) * self.tile_size + (i % tile_area) // self.tile_size
+            if u < self.res[0] and v < self.res[1]:
+                new_color = ti.Vector.zero(ti.f32, 3)
+                n = self.sample_count[u, v]
+                mean = self.luminance_mean[u, v]
+                m2 = self.luminance_m2[u, v]
+                for _ in range(spp_per_launch):
+                    # Pixels of the retired tiles stop early, the sample count indexes the sequence
+                    sampler = startSampler(u, v, n, seed)
+                    ray = self.cam.get_ray(u, v, sampler)
+                    color = self.fragment(ray, u, v, self.res, self.scene, sampler)
+                    new_color += color
+                    # Welford update of the luminance mean and variance. The
+                    # luminance is tone mapped so emitters do not hide the noise
+                    # of the pixels sharing their tile
+                    n += 1
+                    l = luminance(color)
+                    l = l / (1. + l)
+                    delta = l - mean
+                    mean += delta / n
+                    m2 += delta * (l - mean)
+                self.color_buffer[u, v] += new_color
+                self.sample_count[u, v] = n
+                self.luminance_mean[u, v] = mean
+                self.luminance_m2[u, v] = m2
+
+    @ti.kernel
+    def computeTiles(self, threshold: ti.f32, min_spp: ti.i32) -> ti.i32:
+        for tx, ty in self.tile_error:
+            self.tile_error[tx, ty] = 0.
+        for u, v in self.sample_count:
+            n = self.sample_count[u, v]
+            tile = ti.Vector([u // self.tile_size, v // self.tile_size])
+            if n >= ti.max(min_spp, 2):
+                # Variance of the pixel mean
+                self.tile_error[tile] += self.luminance_m2[u, v] / (n - 1) / n
+            else:
+                self.tile_error[tile] = ti.math.inf
+        self.active_tile_number[None] = 0
+        for tx, ty in self.tile_error:
+            # RMS standard error of the tile pixels
+            self.tile_error[tx, ty] = ti.sqrt(self.tile_error[tx, ty] / self.tileArea(tx, ty))
+            if self.tile_error[tx, ty] > threshold:
+                k = ti.atomic_add(self.active_tile_number[None], 1)
+                self.active_tiles[k] = ty * self.tiles[0] + tx
+        return self.active_tile_number[None]
+
+    @ti.func
+    def tileArea(self, tx, ty):
+        # Tiles on the right and top borders can be cut by the image
+        width = ti.min(self.tile_size, self.res[0] - tx * self.tile_size)
+        height = ti.min(self.tile_size, self.res[1] - ty * self.tile_size)
+        return width * height
+
+    def update_tiles(self):
+        """
+        Retire the converged tiles.
+
+        Retired tiles are not sampled anymore, so their error never changes
+        and they stay retired.
+
+        Returns:
+            int: Number of tiles still active, 0 once the whole image is converged.
+        """
+        return self.computeTiles(self.threshold, self.min_spp)
+
+    def image(self):
+        """Mean color of every pixel, as a (width, height, 3) array."""
+        count = self.sample_count.to_numpy()
+        return self.color_buffer.to_numpy() / np.maximum(count, 1)[..., None]
@@ -0,0 +1,60 @@
+import os
+import numpy as np
+
+CHECKPOINT_VERSION = 1
+
+
+def save_checkpoint(path, fields, samples, seed, **metadata):
+    """
+    Atomically write the accumulation state of a render.
+
+    The checkpoint is written to a temporary file next to path and renamed
+    over it, so a crash while writing leaves the previous checkpoint intact.
+
+    Parameters:
+        path (str): Checkpoint file (.npz).
+        fields (dict): Taichi fields of the accumulation, by name.
+        samples (int): Samples per pixel already accumulated.
+        seed (int): Random seed of the render.
+        metadata: Strings and numbers describing the render, checked on resume.
+    """
+    arrays = {f"field_{name}": field.to_numpy() for name, field in fields.items()}
+    arrays.update({f"meta_{name}": np.asarray(value) for name, value in metadata.items()})
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        np.savez(f, version=CHECKPOINT_VERSION, samples=samples, seed=seed, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+
+def load_checkpoint(path):
+    """
+    Read a checkpoint written by save_checkpoint.
+
+    Returns:
+        dict: samples, seed, fields (name -> np.ndarray) and metadata (name -> value).
+    """
+    with np.load(path) as data:
+        if int(data['version']) != CHECKPOINT_VERSION:
+            raise ValueError(f"{path} is a version {int(data['version'])} checkpoint, expected version {CHECKPOINT_VERSION}")
+        return {
+            'samples': int(data['samples']),
+            'seed': int(data['seed']),
+            'fields': {key[len('field_'):]: data[key] for key in data.files if key.startswith('field_')},
+            'metadata': {key[len('meta_'):]: data[key].item() for key in data.files if key.startswith('meta_')},
+        }
+
+
+def restore_fields(fields, checkpoint):
+    """Copy the arrays of a loaded checkpoint back into the matching Taichi fields."""
+    for name, field in fields.items():
+        if name not in checkpoint['fields']:
+            raise ValueError(f"the checkpoint has no {name} buffer")
+        array = checkpoint['fields'][name]
+        if array.shape[:len(field.shape)] != tuple(field.shape):
+            raise ValueError(f"the checkpoint {name} buffer is {array.shape[:len(field.shape)]}, expected {tuple(field.shape)}")
+        field.from_numpy(array)
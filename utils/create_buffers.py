@@ -2,10 +2,12 @@ from ast import Try
 import taichi as ti
 import numpy as np
 from models.quad import Quad
-from models.triangle import Triangle, createTriangle
+from models.triangle import Triangle, IndexedTriangleBuffer, createTriangle
 from models.sphere import Sphere
-from models.mesh import Mesh
+from models.mesh import Mesh, BVHNode, WideBVHNode
 from models.vector import Vec3, Point
+from constants import BVH_WIDTH
+from taichi.lang.util import to_numpy_type
 
 def sphereListToBuffer(sphere_list):
     sphere_number = len(sphere_list)
@@ -34,3 +36,54 @@ def meshListToBuffer(mesh_list):
     for i in range(mesh_number):
         mesh_buffer[i] = mesh_list[i]
     return mesh_buffer
+
+def fieldBytes(field):
+    # Elements times the size of every member, as allocated by taichi
+    if hasattr(field, 'keys'):  # struct field
+        return sum(fieldBytes(getattr(field, name)) for name in field.keys)
+    components = getattr(field, 'n', 1) * getattr(field, 'm', 1)
+    return int(np.prod(field.shape)) * components * np.dtype(to_numpy_type(field.dtype)).itemsize
+
+def triangleBufferBytes(triangle_buffer):
+    """Memory of a Triangle field or of an IndexedTriangleBuffer, in bytes."""
+    if isinstance(triangle_buffer, IndexedTriangleBuffer):
+        return fieldBytes(triangle_buffer.vertices) + fieldBytes(triangle_buffer.indices)
+    return fieldBytes(triangle_buffer)
+
+def createIndexedTriangleBuffer(vertices, faces):
+    # Filled straight from the OBJ vertex and index arrays
+    return IndexedTriangleBuffer(vertices, faces)
+
+def meshAssetToBuffers(mesh_asset, indexed=True):
+    # mesh_asset : (header, arrays) as returned by bvh.asset_cache.load_mesh_asset
+    # indexed : IndexedTriangleBuffer instead of Triangle records, about 4x less memory
+    header, arrays = mesh_asset
+    triangles = arrays['triangles']
+    nodes = arrays['nodes']
+
+    if indexed:
+        triangle_buffer = createIndexedTriangleBuffer(arrays['vertices'], arrays['faces'])
+    else:
+        triangle_buffer = Triangle.field(shape=triangles.shape[0])
+        triangle_buffer.from_numpy({name: triangles[name] for name in triangles.dtype.names})
+
+    bvhNode_buffer = BVHNode.field(shape=nodes.shape[0])
+    bvhNode_buffer.from_numpy({
+        'boundingBox': {'min': nodes['boundingBox']['min'], 'max': nodes['boundingBox']['max']},
+        'childIndex': nodes['childIndex'],
+        'triangleIndex': nodes['triangleIndex'],
+        'triangleCount': nodes['triangleCount'],
+        'escapeIndex': nodes['escapeIndex'],
+    })
+    return triangle_buffer, bvhNode_buffer
+
+def meshAssetToWideBuffer(mesh_asset):
+    # BVH4/BVH8 of the asset, WideBVHNode and hitWide are compiled for constants.BVH_WIDTH
+    _, arrays = mesh_asset
+    wide_nodes = arrays['wide_nodes']
+    width = wide_nodes['childIndex'].shape[1]
+    if width != BVH_WIDTH:
+        raise ValueError(f"the asset has a BVH{width}, constants.BVH_WIDTH is {BVH_WIDTH}")
+    wideBVHNode_buffer = WideBVHNode.field(shape=wide_nodes.shape[0])
+    wideBVHNode_buffer.from_numpy({name: wide_nodes[name] for name in wide_nodes.dtype.names})
+    return wideBVHNode_buffer
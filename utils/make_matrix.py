@@ -56,10 +56,8 @@ def make_rotation_z(angle_degrees: ti.f32):
         [0.0,      0.0,       0.0, 1.0]
     ])
 
-@ti.kernel
-def make_transform_mat(translation: ti.types.vector(3, ti.f32),
-                      rotation_angles: ti.types.vector(3, ti.f32),  # in degrees
-                      scale: ti.types.vector(3, ti.f32)) -> ti.types.matrix(4, 4, ti.f32):
+@ti.func
+def make_world_matrix(translation, rotation_angles, scale):
     # Create individual transformation matrices
     T = make_translation_matrix(translation[0], translation[1], translation[2])
     Rx = make_rotation_x(rotation_angles[0])
@@ -68,5 +66,25 @@ def make_transform_mat(translation: ti.types.vector(3, ti.f32),
     S = make_scale_matrix(scale[0], scale[1], scale[2])
 
     # Combine them (T * R * S)
-    world_matrix = T @ Rz @ Ry @ Rx @ S
+    return T @ Rz @ Ry @ Rx @ S
+
+@ti.kernel
+def make_transform_mat(translation: ti.types.vector(3, ti.f32),
+                      rotation_angles: ti.types.vector(3, ti.f32),  # in degrees
+                      scale: ti.types.vector(3, ti.f32)) -> ti.types.matrix(4, 4, ti.f32):
+    world_matrix = make_world_matrix(translation, rotation_angles, scale)
     return world_matrix.inverse()
+
+@ti.kernel
+def make_world_mat(translation: ti.types.vector(3, ti.f32),
+                   rotation_angles: ti.types.vector(3, ti.f32),  # in degrees
+                   scale: ti.types.vector(3, ti.f32)) -> ti.types.matrix(4, 4, ti.f32):
+    return make_world_matrix(translation, rotation_angles, scale)
+
+@ti.kernel
+def make_normal_mat(worldToLocal: ti.types.matrix(4, 4, ti.f32)) -> ti.types.matrix(3, 3, ti.f32):
+    # Normals go to world space with the transpose of the inverse of the world matrix
+    normal_matrix = ti.Matrix.zero(ti.f32, 3, 3)
+    for i, j in ti.static(ti.ndrange(3, 3)):
+        normal_matrix[i, j] = worldToLocal[j, i]
+    return normal_matrix
@@ -0,0 +1,193 @@
+import taichi as ti
+from models.vector import Vec3
+from constants import PI, SAMPLER
+
+"""
+Sample sequences indexed by (pixel, sample number, dimension, seed) and the
+mappings from two uniforms to directions.
+
+Every uniform is a pure function of its indices, there is no random state:
+a pixel gets the same samples whatever the launches, tiles or processes
+the render is split into.
+
+Backends, chosen with SAMPLER in constants.py:
+    'random'     : independent uniforms, from a PCG hash of the indices
+    'sobol'      : 2D Sobol points, shuffled and Owen-scrambled per pixel and
+                   dimension with hash-based nested uniform scrambling
+    'r2'         : Roberts' R2 sequence, shuffled and randomly rotated per pixel and dimension
+    'blue_noise' : R2 sequence rotated by the pixel-space R2 dither mask, which
+                   spreads the error of neighbouring pixels as blue noise
+Dimension d is the d-th pair of uniforms drawn along a path.
+"""
+
+# 1 / plastic number and its square, the R2 steps, in 0.32 fixed point so
+# that large sample numbers keep their precision
+R2_ALPHA = (3242174889, 2447445414)
+# Dimensions of a path : the camera jitter, then for every bounce a light
+# sample, a BSDF sample and the Russian roulette
+LIGHT_DIMENSION = 0
+BSDF_DIMENSION = 1
+ROULETTE_DIMENSION = 2
+BOUNCE_DIMENSIONS = 3
+
+
+@ti.func
+def hashU32(x):
+    # PCG output permutation of a single 32-bit state
+    state = ti.cast(x, ti.u32) * ti.u32(747796405) + ti.u32(2891336453)
+    word = ((state >> ((state >> ti.u32(28)) + ti.u32(4))) ^ state) * ti.u32(277803737)
+    return (word >> ti.u32(22)) ^ word
+
+
+@ti.func
+def hashCombine(seed, value):
+    return hashU32(seed ^ (hashU32(value) + ti.u32(0x9e3779b9) + (seed << ti.u32(6)) + (seed >> ti.u32(2))))
+
+
+@ti.func
+def reverseBits(x):
+    x = ((x >> ti.u32(1)) & ti.u32(0x55555555)) | ((x & ti.u32(0x55555555)) << ti.u32(1))
+    x = ((x >> ti.u32(2)) & ti.u32(0x33333333)) | ((x & ti.u32(0x33333333)) << ti.u32(2))
+    x = ((x >> ti.u32(4)) & ti.u32(0x0F0F0F0F)) | ((x & ti.u32(0x0F0F0F0F)) << ti.u32(4))
+    x = ((x >> ti.u32(8)) & ti.u32(0x00FF00FF)) | ((x & ti.u32(0x00FF00FF)) << ti.u32(8))
+    return (x >> ti.u32(16)) | (x << ti.u32(16))
+
+
+@ti.func
+def laineKarrasPermutation(x, seed):
+    x += seed
+    x ^= x * ti.u32(0x6c50b47c)
+    x ^= x * ti.u32(0xb82f1e52)
+    x ^= x * ti.u32(0xc7afe638)
+    x ^= x * ti.u32(0x8d22f6e6)
+    return x
+
+
+@ti.func
+def nestedUniformScramble(x, seed):
+    # Owen scrambling of the bits of x (Burley 2020)
+    return reverseBits(laineKarrasPermutation(reverseBits(x), seed))
+
+
+@ti.func
+def sobol2D(index):
+    # First two Sobol dimensions : van der Corput, and the (1, 3) generator
+    x = reverseBits(index)
+    y = ti.u32(0)
+    direction = ti.u32(1) << ti.u32(31)
+    for _ in range(32):
+        if index & ti.u32(1):
+            y ^= direction
+        index >>= ti.u32(1)
+        direction ^= direction >> ti.u32(1)
+    return x, y
+
+
+@ti.func
+def unitFloat(x):
+    # Top 24 bits, so the result stays below 1 in f32
+    return ti.cast(x >> ti.u32(8), ti.f32) * (1. / 16777216.)
+
+
+@ti.func
+def r2(index, offset_x, offset_y):
+    # Wrapping u32 arithmetic is the fractional part
+    return ti.Vector([unitFloat(offset_x + index * ti.u32(R2_ALPHA[0])), unitFloat(offset_y + index * ti.u32(R2_ALPHA[1]))])
+
+
+@ti.dataclass
+class Sampler:
+    """Sample stream of one path, see startSampler."""
+    x: ti.i32
+    y: ti.i32
+    render_seed: ti.u32
+    seed: ti.u32  # hash of the pixel and the render seed
+    index: ti.u32  # sample number in the pixel
+    dimension: ti.u32
+
+    @ti.func
+    def next2D(self):
+        """Next pair of uniforms of the path, in [0, 1)^2."""
+        xi = ti.Vector([0., 0.])
+        if ti.static(SAMPLER == 'random'):
+            dimension_seed = hashCombine(hashCombine(self.seed, self.dimension), self.index)
+            xi = ti.Vector([unitFloat(hashCombine(dimension_seed, 1)), unitFloat(hashCombine(dimension_seed, 2))])
+        elif ti.static(SAMPLER == 'sobol'):
+            dimension_seed = hashCombine(self.seed, self.dimension)
+            index = nestedUniformScramble(self.index, dimension_seed)
+            x, y = sobol2D(index)
+            xi = ti.Vector([unitFloat(nestedUniformScramble(x, hashCombine(dimension_seed, 1))),
+                            unitFloat(nestedUniformScramble(y, hashCombine(dimension_seed, 2)))])
+        elif ti.static(SAMPLER == 'r2'):
+            dimension_seed = hashCombine(self.seed, self.dimension)
+            index = nestedUniformScramble(self.index, dimension_seed)
+            xi = r2(index, hashCombine(dimension_seed, 1), hashCombine(dimension_seed, 2))
+        else:
+            # The pixel offset follows the R2 dither mask, so neighbouring
+            # pixels get well spread rotations, shifted for every dimension
+            dimension_seed = hashCombine(self.render_seed, self.dimension)
+            mask = ti.cast(self.x, ti.u32) * ti.u32(R2_ALPHA[0]) + ti.cast(self.y, ti.u32) * ti.u32(R2_ALPHA[1])
+            xi = r2(self.index, mask + hashCombine(dimension_seed, 1), mask + hashCombine(dimension_seed, 2))
+        self.dimension += 1
+        return xi
+
+    @ti.func
+    def next1D(self):
+        return self.next2D()[0]
+
+    @ti.func
+    def startBounce(self, k, purpose=LIGHT_DIMENSION):
+        # Every sample of a bounce has a fixed dimension, so the same dimension
+        # is used for the same purpose in all the samples of a pixel
+        self.dimension = 1 + BOUNCE_DIMENSIONS * k + purpose
+
+
+@ti.func
+def startSampler(u, v, index, render_seed=0):
+    """Sampler of the sample number index of pixel (u, v), the same render_seed renders the same image."""
+    global_seed = ti.cast(render_seed, ti.u32)
+    seed = hashCombine(hashCombine(hashU32(global_seed), u), v)
+    return Sampler(x=u, y=v, render_seed=global_seed, seed=seed, index=ti.cast(index, ti.u32), dimension=0)
+
+
+@ti.func
+def orthonormalBasis(w):
+    # Two unit vectors orthogonal to w and to each other
+    a = Vec3(1., 0., 0.)
+    if ti.abs(w.x) > 0.9:
+        a = Vec3(0., 1., 0.)
+    v = ti.math.normalize(ti.math.cross(w, a))
+    u = ti.math.cross(v, w)
+    return u, v
+
+
+@ti.func
+def uniformSphere(xi):
+    # Archimedes: z uniform in [-1, 1] is uniform on the sphere
+    z = 1. - 2. * xi[0]
+    r = ti.sqrt(ti.max(0., 1. - z * z))
+    phi = 2. * PI * xi[1]
+    return Vec3(r * ti.cos(phi), r * ti.sin(phi), z)
+
+
+@ti.func
+def toWorld(local, normal):
+    u, v = orthonormalBasis(normal)
+    return local[0] * u + local[1] * v + local[2] * normal
+
+
+@ti.func
+def uniformHemisphere(normal, xi):
+    # pdf 1 / (2 pi)
+    z = xi[0]
+    r = ti.sqrt(ti.max(0., 1. - z * z))
+    phi = 2. * PI * xi[1]
+    return toWorld(Vec3(r * ti.cos(phi), r * ti.sin(phi), z), normal)
+
+
+@ti.func
+def cosineHemisphere(normal, xi):
+    # Malley: uniform on the disk, projected on the hemisphere. pdf cos / pi
+    r = ti.sqrt(xi[0])
+    phi = 2. * PI * xi[1]
+    return toWorld(Vec3(r * ti.cos(phi), r * ti.sin(phi), ti.sqrt(ti.max(0., 1. - xi[0]))), normal)
@@ -0,0 +1,133 @@
+import contextlib
+import json
+import time
+import taichi as ti
+import numpy as np
+from constants import STATS
+
+# Opt-in render statistics, compiled in when STATS is True in constants.py.
+# The integrators record the counters of every path in the pixel of its
+# sampler, the BVH traversals the deepest stack they used, and the renderers
+# time their host stages. With STATS False every record is removed at
+# compile time and the stages are not synced.
+
+# Sums of every pixel, in this order
+COUNTERS = ('samples', 'rays', 'box_tests', 'triangle_tests', 'path_length')
+
+# Allocated by allocate, once the resolution is known
+pixel_counters = None
+max_stack_depth = None
+# Stage name -> {'calls', 'wall_time', 'kernel_time'}, in seconds
+stages = {}
+
+
+def allocate(res):
+    """Create the counter fields of a res image, nothing is allocated when STATS is False."""
+    global pixel_counters, max_stack_depth
+    if not STATS:
+        return
+    pixel_counters = ti.Vector.field(len(COUNTERS), dtype=ti.i32, shape=res)
+    max_stack_depth = ti.field(ti.i32, shape=())
+
+
+@ti.func
+def record(x, y, samples, rays, box_tests, triangle_tests, path_length):
+    if ti.static(STATS):
+        pixel_counters[x, y] += ti.Vector([samples, rays, box_tests, triangle_tests, path_length])
+
+
+@ti.func
+def recordStackDepth(depth):
+    # High-water mark of the traversal stacks, against the sizes of their stack arrays
+    if ti.static(STATS):
+        ti.atomic_max(max_stack_depth[None], depth)
+
+
+def reset():
+    stages.clear()
+    if STATS:
+        pixel_counters.fill(0)
+        max_stack_depth[None] = 0
+        ti.profiler.clear_kernel_profiler_info()
+
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Time a host stage, e.g. `with stage('render'): paint(...)`.
+
+    The wall time is measured between two syncs, the kernel time is the
+    time of the kernels launched by the stage, from the kernel profiler of
+    ti.init(kernel_profiler=STATS).
+    """
+    if not STATS:
+        yield
+        return
+    ti.sync()
+    kernel_start = ti.profiler.get_kernel_profiler_total_time()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        ti.sync()
+        timing = stages.setdefault(name, {'calls': 0, 'wall_time': 0., 'kernel_time': 0.})
+        timing['calls'] += 1
+        timing['wall_time'] += time.perf_counter() - start
+        timing['kernel_time'] += ti.profiler.get_kernel_profiler_total_time() - kernel_start
+
+
+def pixel_image(name):
+    """Per pixel sum of a counter of COUNTERS, as a (width, height) array."""
+    return pixel_counters.to_numpy()[..., COUNTERS.index(name)]
+
+
+def pixel_means():
+    """Counters of COUNTERS per sample of every pixel, by name, as (width, height) arrays."""
+    counters = pixel_counters.to_numpy()
+    samples = np.maximum(counters[..., 0], 1)
+    return {name: counters[..., i] / samples for i, name in enumerate(COUNTERS) if name != 'samples'}
+
+
+def summary():
+    """
+    Global counters since the last reset.
+
+    Returns:
+        dict: Totals of COUNTERS, means per path and per ray, deepest
+        traversal stack, most expensive pixel and stage timings.
+    """
+    counters = pixel_counters.to_numpy().astype(np.int64)
+    totals = {name: int(counters[..., i].sum()) for i, name in enumerate(COUNTERS)}
+    samples = max(totals['samples'], 1)
+    rays = max(totals['rays'], 1)
+    # BVH tests per sample of every pixel, the hot spots of the image
+    cost = (counters[..., 2] + counters[..., 3]) / np.maximum(counters[..., 0], 1)
+    hottest = np.unravel_index(np.argmax(cost), cost.shape)
+    return {
+        'totals': totals,
+        'rays_per_path': totals['rays'] / samples,
+        'path_length': totals['path_length'] / samples,
+        'box_tests_per_ray': totals['box_tests'] / rays,
+        'triangle_tests_per_ray': totals['triangle_tests'] / rays,
+        'max_stack_depth': int(max_stack_depth[None]),
+        'hottest_pixel': {'pixel': [int(hottest[0]), int(hottest[1])], 'tests_per_sample': float(cost[hottest])},
+        'stages': {name: dict(timing) for name, timing in stages.items()},
+    }
+
+
+def print_summary(frame=None):
+    frame = summary() if frame is None else frame
+    totals = frame['totals']
+    print(f"{totals['samples']:,} paths | {totals['rays']:,} rays | {frame['rays_per_path']:.2f} rays per path | path length {frame['path_length']:.2f}")
+    print(f"{frame['box_tests_per_ray']:.1f} box tests and {frame['triangle_tests_per_ray']:.1f} triangle tests per ray | deepest stack {frame['max_stack_depth']}")
+    hottest = frame['hottest_pixel']
+    print(f"hottest pixel {tuple(hottest['pixel'])} : {hottest['tests_per_sample']:.0f} tests per sample")
+    for name, timing in frame['stages'].items():
+        print(f"  {name:<12} {timing['calls']:>6} calls {timing['wall_time']:>9.3f}s wall {timing['kernel_time']:>9.3f}s kernels")
+
+
+def dump_json(path, frame=None, **metadata):
+    """Write the summary, with metadata describing the render, to a JSON file."""
+    frame = summary() if frame is None else frame
+    with open(path, 'w') as f:
+        json.dump(dict(metadata, **frame), f, indent=2)
@@ -0,0 +1,76 @@
+import taichi as ti
+import numpy as np
+
+TONE_MAPPINGS = ('none', 'reinhard', 'aces')
+
+
+@ti.func
+def reinhard(color):
+    return color / (1. + color)
+
+
+@ti.func
+def aces(color):
+    # Narkowicz fit of the ACES filmic curve
+    return (color * (2.51 * color + 0.03)) / (color * (2.43 * color + 0.59) + 0.14)
+
+
+@ti.data_oriented
+class ToneMapper:
+    """
+    Turns an accumulation buffer into an 8-bit image on the device.
+
+    The 1/N normalisation, exposure, tone mapping, gamma and clamping run in
+    one kernel writing display_buffer, so the host only ever reads 8-bit
+    pixels, 4 times less than the float32 accumulation.
+    """
+    def __init__(self, res, tone_mapping='aces', exposure=1., gamma=2.2) -> None:
+        if tone_mapping not in TONE_MAPPINGS:
+            raise ValueError(f"unknown tone mapping {tone_mapping}, expected one of {TONE_MAPPINGS}")
+        self.res = res
+        self.tone_mapping = tone_mapping
+        self.exposure = exposure
+        self.gamma = gamma
+        self.display_buffer = ti.Vector.field(3, dtype=ti.u8, shape=res)
+
+    @ti.func
+    def encode(self, color, scale, inv_gamma):
+        color = ti.max(color * scale, 0.)
+        if ti.static(self.tone_mapping == 'reinhard'):
+            color = reinhard(color)
+        elif ti.static(self.tone_mapping == 'aces'):
+            color = aces(color)
+        color = ti.min(ti.pow(color, inv_gamma), 1.)
+        return ti.cast(color * 255. + 0.5, ti.u8)
+
+    @ti.kernel
+    def developUniform(self, color_buffer: ti.template(), scale: ti.f32, inv_gamma: ti.f32):
+        for u, v in self.display_buffer:
+            self.display_buffer[u, v] = self.encode(color_buffer[u, v], scale, inv_gamma)
+
+    @ti.kernel
+    def developCounts(self, color_buffer: ti.template(), sample_count: ti.template(), exposure: ti.f32, inv_gamma: ti.f32):
+        for u, v in self.display_buffer:
+            scale = exposure / ti.max(sample_count[u, v], 1)
+            self.display_buffer[u, v] = self.encode(color_buffer[u, v], scale, inv_gamma)
+
+    def develop(self, color_buffer, samples):
+        """
+        Fill display_buffer from a sum of samples.
+
+        Parameters:
+            color_buffer (ti.Field): Sum of the samples of every pixel.
+            samples (int or ti.Field): Number of samples of all the pixels, or a field of per pixel counts.
+
+        Returns:
+            ti.Field: display_buffer, ready for gui.set_image.
+        """
+        if isinstance(samples, int):
+            self.developUniform(color_buffer, self.exposure / max(samples, 1), 1. / self.gamma)
+        else:
+            self.developCounts(color_buffer, samples, self.exposure, 1. / self.gamma)
+        return self.display_buffer
+
+    def image(self):
+        """Upright (height, width, 3) uint8 array of display_buffer, to save it."""
+        return np.rot90(self.display_buffer.to_numpy(), k=1)